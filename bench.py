@@ -0,0 +1,327 @@
+import argparse, os, random, shutil, string, subprocess, sys, tempfile
+from datetime import datetime
+from fnmatch import fnmatch
+from json import dumps, loads
+from pathlib import Path
+from time import perf_counter
+from config import Config, Filter, Target
+from matcher import FilterMatcher
+
+# Headless benchmarks, nothing here imports Qt.
+#   python bench.py filters --count 200000
+#   python bench.py memory --count 1000000
+#   python bench.py pipeline --sizes 10000,100000,1000000
+
+RESULTS_FILE = 'bench_results.jsonl'
+
+# Roughly what a downloads folder looks like, weighted by how often each extension shows up
+EXTENSIONS = [
+    ('jpg', 20), ('png', 10), ('jpeg', 3), ('gif', 2), ('pdf', 12), ('docx', 5), ('txt', 6), ('xlsx', 3),
+    ('zip', 8), ('rar', 2), ('7z', 1), ('exe', 5), ('msi', 2), ('mp3', 4), ('flac', 1), ('mp4', 5),
+    ('mkv', 1), ('py', 2), ('js', 1), ('json', 2), ('csv', 2), ('iso', 1), ('tar.gz', 1), ('part', 1), ('', 2)
+]
+DEEP_MAX_DEPTH = 8
+HUGE_FILE_SIZE = 2 * 1024 * 1024 * 1024
+
+def random_names(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    extensions = [ext for ext, _ in EXTENSIONS]
+    weights = [weight for _, weight in EXTENSIONS]
+    names = []
+    for i, ext in enumerate(rng.choices(extensions, weights, k=count)):
+        stem = ''.join(rng.choices(string.ascii_lowercase + string.digits + ' _-', k=rng.randint(4, 24)))
+        names.append(f'{stem}{i}.{ext}' if ext else f'{stem}{i}')
+    return names
+
+def large_filters(count: int = 150, seed: int = 0):
+    rng = random.Random(seed)
+    filters = []
+    for i in range(count // 5):
+        expressions = []
+        for j in range(5):
+            kind = rng.random()
+            ext = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 4)))
+            if kind < 0.8:
+                expressions.append(f'*.{ext}')
+            elif kind < 0.9:
+                expressions.append(f'{ext}*')
+            else:
+                expressions.append(f'*_{ext}_*.[a-z]*')
+        filters.append(Filter(f'Filter {i}', expressions, f'Folder {i}'))
+    return filters + [Filter(filter.name, list(filter.expressions), filter.folder) for filter in Config.filters]
+
+FILTER_SETS = {
+    'default': lambda: [Filter(filter.name, list(filter.expressions), filter.folder) for filter in Config.filters],
+    'large': large_filters,
+}
+
+# Matching only
+
+def fnmatch_loop(filters: list[Filter], names: list[str]):
+    results = []
+    for name in names:
+        found = None
+        for index, filter in enumerate(filters):
+            for expression in filter.expressions:
+                if fnmatch(name, expression):
+                    found = index
+                    break
+            if found is not None:
+                break
+        results.append(found)
+    return results
+
+def matcher_loop(filters: list[Filter], names: list[str]):
+    matcher = FilterMatcher(filters)
+    return [matcher.match(name) for name in names]
+
+def process_loop(filters: list[Filter], names: list[str], processes: int):
+    from matcher import ProcessMatcher
+    matcher = ProcessMatcher(FilterMatcher(filters), processes)
+    try:
+        # The first batch waits for the processes to start, keep it out of the timing
+        list(matcher.match_names(names[:1], str))
+        start = perf_counter()
+        results = [None if best is None else best[1] for _, best in matcher.match_names(names, str)]
+        return results, perf_counter() - start
+    finally:
+        matcher.close()
+
+def bench_filters(count: int, processes: int = 0):
+    names = random_names(count)
+    for label, make_filters in FILTER_SETS.items():
+        filters = make_filters()
+        start = perf_counter()
+        expected = fnmatch_loop(filters, names)
+        loop_time = perf_counter() - start
+
+        start = perf_counter()
+        got = matcher_loop(filters, names)
+        matcher_time = perf_counter() - start
+
+        if got != expected:
+            raise AssertionError(f'Matcher disagrees with fnmatch on the {label} filter set')
+        line = f'{label:>8} filters, {count} names: fnmatch {loop_time:.3f}s, matcher {matcher_time:.3f}s ({loop_time / matcher_time:.1f}x)'
+        if processes > 1:
+            got, process_time = process_loop(filters, names, processes)
+            if got != expected:
+                raise AssertionError(f'Process matcher disagrees with fnmatch on the {label} filter set')
+            line += f', {processes} processes {process_time:.3f}s ({loop_time / process_time:.1f}x)'
+        print(line)
+
+# Memory held by the per-file records
+
+class LegacyFileInstance:
+    # What helper.FileInstance looked like before it was made compact, kept for comparison
+    def __init__(self, file, config, target, entry=None):
+        self.file = file
+        self.config = config
+        self.target = target
+        self.entry = entry
+        self.filter = None
+        self.filter_index = -1
+        self.origin = Path(entry.path) if entry is not None else Path(target.path) / file
+        self.target_path = None
+
+    def apply_filter(self, filter):
+        self.filter = filter
+        self.target_path = Path(self.target.path) / filter.folder / self.file
+
+def record_memory(make, names: list[str]):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        records = [make(name) for name in names]
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current, len(records)
+
+def bench_memory(count: int):
+    from helper import EntryStat, FileInstance
+    names = random_names(count)
+    work = Path(tempfile.mkdtemp(prefix='fc-bench-'))
+    try:
+        config = Config(exe_path=work)
+        target = config.targets[0]
+        matcher = FilterMatcher(config.filters)
+        matches = {name: matcher.match(name) for name in names}
+
+        def legacy(name):
+            file_instance = LegacyFileInstance(name, config, target)
+            if matches[name] is not None:
+                file_instance.filter_index = matches[name]
+                file_instance.apply_filter(config.filters[matches[name]])
+            return file_instance
+
+        # Scanned records carry the stat of their entry, each with values of its own
+        template = os.lstat(work)
+        numbers = iter(range(1, count + 1))
+
+        def entry_stat():
+            number = next(numbers)
+            entry_stat = EntryStat(template)
+            entry_stat.st_size = template.st_size + number
+            entry_stat.st_mtime_ns = template.st_mtime_ns + number
+            entry_stat.st_ino = template.st_ino + number
+            return entry_stat
+
+        def compact(name):
+            file_instance = FileInstance(name, 0, entry_stat())
+            if matches[name] is not None:
+                file_instance.filter_index = matches[name]
+            return file_instance
+
+        # The names themselves are shared by both and not counted
+        legacy_bytes, _ = record_memory(legacy, names)
+        compact_bytes, _ = record_memory(compact, names)
+        print(
+            f'{count} records: legacy {legacy_bytes / 1024 / 1024:.1f} MB ({legacy_bytes / count:.0f} B each), '
+            f'compact {compact_bytes / 1024 / 1024:.1f} MB ({compact_bytes / count:.0f} B each), '
+            f'{legacy_bytes / compact_bytes:.1f}x smaller'
+        )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+# Whole pipeline on synthetic targets
+
+def generate_tree(root: Path, count: int, deep: bool, huge: int, seed: int = 0):
+    rng = random.Random(seed)
+    created_dirs = {str(root)}
+    os.makedirs(root, exist_ok=True)
+    for name in random_names(count, seed):
+        folder = str(root)
+        if deep:
+            for _ in range(rng.randint(0, DEEP_MAX_DEPTH)):
+                folder = os.path.join(folder, f'd{rng.randint(0, 9)}')
+            if folder not in created_dirs:
+                os.makedirs(folder, exist_ok=True)
+                created_dirs.add(folder)
+        os.close(os.open(os.path.join(folder, name), os.O_CREAT | os.O_WRONLY, 0o644))
+    for i in range(huge):
+        # Sparse files, big to the filesystem calls but cheap on disk
+        with open(root / f'huge{i}.iso', 'wb') as f:
+            f.truncate(HUGE_FILE_SIZE)
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_scenario(layout: str, count: int, filters_name: str, huge: int):
+    import mover
+    from foldercleaner import TextProgress
+    from helper import clean_folders
+
+    # Every generated file is brand new, do not skip them as still being written
+    mover.RECENT_WRITE_SECONDS = 0
+
+    work = Path(tempfile.mkdtemp(prefix='fc-bench-'))
+    try:
+        root = work / 'target'
+        start = perf_counter()
+        generate_tree(root, count, layout == 'deep', huge)
+        generate_time = perf_counter() - start
+        baseline_memory = peak_memory_mb()
+
+        config = Config(exe_path=work / 'conf')
+        config.filters = FILTER_SETS[filters_name]()
+        config.targets = [Target('bench', root.as_posix(), recursive=layout == 'deep')]
+        config.scan_index = False
+
+        report = clean_folders(config, TextProgress())
+        data = report.json()
+        return {
+            'generate': round(generate_time, 3),
+            'phases': data['phases'],
+            'moved': data['moved'],
+            'files_per_second': data['files_per_second'],
+            'peak_memory_mb': peak_memory_mb(),
+            'baseline_memory_mb': baseline_memory
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def load_results(file: Path):
+    results = {}
+    try:
+        with open(file, 'r', encoding='utf-8') as f:
+            for line in f:
+                result = loads(line)
+                results[result['scenario']] = result
+    except OSError:
+        pass
+    return results
+
+def bench_pipeline(sizes: list[int], layouts: list[str], filter_sets: list[str], huge: int, output: Path):
+    previous = load_results(output)
+    for layout in layouts:
+        for count in sizes:
+            for filters_name in filter_sets:
+                scenario = f'{layout}-{count}-{filters_name}'
+                # A fresh interpreter per scenario so the peak memory belongs to this run only
+                arguments = dumps([layout, count, filters_name, huge])
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), 'run-one', arguments],
+                    capture_output=True, text=True, check=True
+                )
+                result = loads(completed.stdout.strip().splitlines()[-1])
+                result['scenario'] = scenario
+                result['date'] = datetime.now().isoformat(timespec='seconds')
+
+                phases = result['phases']
+                line = (
+                    f"{scenario:>24}: total {phases['total']:.3f}s (scan {phases['scan']:.3f}s, classify {phases['classify']:.3f}s, "
+                    f"move {phases['move']:.3f}s), {result['files_per_second']:.0f} files/s"
+                )
+                if result['peak_memory_mb'] is not None:
+                    line += f", peak {result['peak_memory_mb']:.0f} MB"
+                before = previous.get(scenario)
+                if before:
+                    change = (phases['total'] - before['phases']['total']) / (before['phases']['total'] or 1e-9) * 100
+                    line += f" ({change:+.1f}% vs {before['date']})"
+                print(line, flush=True)
+
+                with open(output, 'a', encoding='utf-8') as f:
+                    f.write(dumps(result) + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Folder Cleaner benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    filters_parser = commands.add_parser('filters', help='compiled matcher against the fnmatch loop')
+    filters_parser.add_argument('--count', type=int, default=200_000)
+    filters_parser.add_argument('--processes', type=int, default=0, help='also time the multi-process matcher')
+
+    memory_parser = commands.add_parser('memory', help='memory held by the per-file records')
+    memory_parser.add_argument('--count', type=int, default=1_000_000)
+
+    pipeline_parser = commands.add_parser('pipeline', help='scan, classify and move synthetic targets')
+    pipeline_parser.add_argument('--sizes', default='10000,100000', help='comma separated entry counts, e.g. 10000,100000,1000000')
+    pipeline_parser.add_argument('--layouts', default='flat,deep', help='flat and/or deep')
+    pipeline_parser.add_argument('--filters', default='default,large', help='default and/or large')
+    pipeline_parser.add_argument('--huge', type=int, default=3, help='number of 2 GB sparse files per target')
+    pipeline_parser.add_argument('--output', default=RESULTS_FILE, help='results are appended here and compared with the previous run')
+
+    run_one_parser = commands.add_parser('run-one')
+    run_one_parser.add_argument('arguments')
+
+    args = parser.parse_args(argv)
+    if args.command == 'filters':
+        bench_filters(args.count, args.processes)
+    elif args.command == 'memory':
+        bench_memory(args.count)
+    elif args.command == 'pipeline':
+        bench_pipeline(
+            [int(size) for size in args.sizes.split(',')], args.layouts.split(','), args.filters.split(','),
+            args.huge, Path(args.output)
+        )
+    else:
+        print(dumps(run_scenario(*loads(args.arguments))))
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-python -m PyInstaller --noconfirm --onefile --windowed --icon ".\icon.ico" --name "Folder Cleaner" --add-data ".\config.py;." --add-data ".\helper.py;." --add-data ".\icon.png;." --add-data ".\ui.py;." --add-data ".\widgets.py;." --hidden-import PyQt6.QtWidgets --hidden-import PyQt6.QtGui --hidden-import PyQt6.QtCore ".\main.py"
+python -m PyInstaller --noconfirm --onefile --windowed --icon ".\icon.ico" --name "Folder Cleaner" --add-data ".\config.py;." --add-data ".\cron.py;." --add-data ".\content.py;." --add-data ".\dedupe.py;." --add-data ".\helper.py;." --add-data ".\matcher.py;." --add-data ".\mover.py;." --add-data ".\plan.py;." --add-data ".\report.py;." --add-data ".\scheduler.py;." --add-data ".\scan_index.py;." --add-data ".\icon.png;." --add-data ".\journal.py;." --add-data ".\throttle.py;." --add-data ".\transfer.py;." --add-data ".\ui.py;." --add-data ".\watcher.py;." --add-data ".\widgets.py;." --add-data ".\worker.py;." --hidden-import PyQt6.QtWidgets --hidden-import PyQt6.QtGui --hidden-import PyQt6.QtCore ".\main.py"
 
 set /p deleteBuildFolder="Do you want to delete the build folder? (y/n): "
 if /i "%deleteBuildFolder%"=="y" (
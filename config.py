@@ -1,8 +1,56 @@
 import os, sys
 from json import dumps, loads, JSONEncoder
 from pathlib import Path
+from cron import parse_schedule
 home = Path.home()
 
+CONFIG_FILE = 'fc.conf'
+
+def _check(condition, message: str):
+    if not condition:
+        raise ValueError(f'Invalid {CONFIG_FILE}: {message}')
+
+def _is_count(value, minimum: int = 1):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= minimum
+
+def validate(data):
+    # Raises ValueError on anything Config.load could not use as it is
+    _check(isinstance(data, dict), 'not a JSON object')
+    _check(isinstance(data.get('theme'), str), 'theme must be a string')
+    _check(isinstance(data.get('filters'), list), 'filters must be a list')
+    for number, filter in enumerate(data['filters'], 1):
+        _check(isinstance(filter, dict), f'filter {number} must be an object')
+        _check(isinstance(filter.get('name'), str) and isinstance(filter.get('folder'), str) and filter['folder'], f'filter {number} needs a name and a folder')
+        expressions = filter.get('expressions')
+        _check(isinstance(expressions, list) and all(isinstance(expression, str) for expression in expressions), f'expressions of filter {filter["name"]} must be strings')
+    _check(isinstance(data.get('targets'), list), 'targets must be a list')
+    for number, target in enumerate(data['targets'], 1):
+        _check(isinstance(target, dict), f'target {number} must be an object')
+        _check(isinstance(target.get('name'), str) and isinstance(target.get('path'), str) and target['path'], f'target {number} needs a name and a path')
+        _check(target.get('max_moves') is None or _is_count(target['max_moves']), f'max_moves of target {target["name"]} must be a positive number')
+        _check(target.get('in_use_check', 'fast') in ('fast', 'strict'), f'in_use_check of target {target["name"]} must be fast or strict')
+        _check(isinstance(target.get('recursive', False), bool), f'recursive of target {target["name"]} must be true or false')
+        _check(target.get('max_depth') is None or _is_count(target['max_depth'], 0), f'max_depth of target {target["name"]} must be a number')
+        exclude = target.get('exclude') or []
+        _check(isinstance(exclude, list) and all(isinstance(glob, str) for glob in exclude), f'exclude of target {target["name"]} must be a list of globs')
+        if target.get('schedule') is not None:
+            _check(isinstance(target['schedule'], str), f'schedule of target {target["name"]} must be a string')
+            try:
+                parse_schedule(target['schedule'])
+            except ValueError as e:
+                _check(False, f'schedule of target {target["name"]}: {e}')
+        for key in ('max_files_per_second', 'max_mb_per_second'):
+            value = target.get(key)
+            _check(value is None or (isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0), f'{key} of target {target["name"]} must be a positive number')
+        _check(isinstance(target.get('low_priority', False), bool), f'low_priority of target {target["name"]} must be true or false')
+    for key in ('move_workers', 'moves_per_target', 'moves_per_device', 'content_workers', 'hash_workers'):
+        _check(key not in data or _is_count(data[key]), f'{key} must be a positive number')
+    _check('classify_processes' not in data or _is_count(data['classify_processes'], 0), 'classify_processes must be a number')
+    for key in ('scan_index', 'filter_cache'):
+        _check(isinstance(data.get(key, True), bool), f'{key} must be true or false')
+    _check(data.get('dedupe') in (None, 'move', 'hardlink'), 'dedupe must be null, move or hardlink')
+    _check(data.get('collisions', 'suffix') in ('suffix', 'skip', 'newer', 'hash'), 'collisions must be suffix, skip, newer or hash')
+
 class Filter(JSONEncoder):
     def __init__(self, name, expressions, folder):
         self.name = name
@@ -27,18 +75,48 @@ class Filter(JSONEncoder):
         return f'Filter({self.name}, {self.expressions}, {self.folder})'
 
 class Target(JSONEncoder):
-    def __init__(self, name, path):
+    def __init__(self, name, path, max_moves=None, in_use_check='fast', recursive=False, max_depth=None, exclude=None,
+                 schedule=None, max_files_per_second=None, max_mb_per_second=None, low_priority=False):
         self.name = name
         self.path = path
+        # Moves running at once inside this target, None uses Config.moves_per_target
+        self.max_moves = max_moves
+        # 'fast' relies on stat data and the rename itself, 'strict' also opens every file before moving it
+        self.in_use_check = in_use_check
+        # Sort the files of subfolders too, down to max_depth levels (None for no limit)
+        self.recursive = recursive
+        self.max_depth = max_depth
+        # Globs matched against entry names and paths relative to the target, matching entries are left alone
+        self.exclude = exclude or []
+        # Interval ('30m') or cron expression ('0 2 * * *') of the scheduled cleanings, None when only cleaned by hand
+        self.schedule = schedule
+        # Limits of the scheduled cleanings, None for no limit
+        self.max_files_per_second = max_files_per_second
+        self.max_mb_per_second = max_mb_per_second
+        # Scheduled cleanings run at the lowest CPU and I/O priority
+        self.low_priority = low_priority
 
     @staticmethod
     def from_json(data):
-        return Target(data['name'], data['path'])
+        return Target(
+            data['name'], data['path'], data.get('max_moves'), data.get('in_use_check', 'fast'),
+            data.get('recursive', False), data.get('max_depth'), data.get('exclude'),
+            data.get('schedule'), data.get('max_files_per_second'), data.get('max_mb_per_second'), data.get('low_priority', False)
+        )
 
     def json(self):
         return {
             'name': self.name,
-            'path': self.path
+            'path': self.path,
+            'max_moves': self.max_moves,
+            'in_use_check': self.in_use_check,
+            'recursive': self.recursive,
+            'max_depth': self.max_depth,
+            'exclude': self.exclude,
+            'schedule': self.schedule,
+            'max_files_per_second': self.max_files_per_second,
+            'max_mb_per_second': self.max_mb_per_second,
+            'low_priority': self.low_priority
         }
 
     def __str__(self):
@@ -49,6 +127,30 @@ class Target(JSONEncoder):
 
 class Config:
     theme = 'dark_blue.xml'
+    move_workers = 8
+    moves_per_target = 4
+    moves_per_device = 4
+    # Remember what each target looked like to skip unchanged folders and entries
+    scan_index = True
+    # Processes matching names against the filters, 0 or 1 matches them in the scanning thread.
+    # Worth it on listings of a million entries and more, on a machine with cores to spare.
+    classify_processes = 0
+    # Threads reading file headers for 'mime:' filter expressions
+    content_workers = 8
+    # None, or what to do with the copies of a file found in one run: 'move' them to a
+    # Duplicates folder inside their target, or replace them with a 'hardlink' to the copy kept
+    dedupe = None
+    # Threads hashing the files of the same size for the dedupe stage
+    hash_workers = 4
+    # Keep the translated filters in fc.filters.bin, a restart does not translate them again
+    filter_cache = True
+    # When a destination name is taken: move as 'name (1).ext' ('suffix'), leave the file ('skip'),
+    # replace the destination with a 'newer' file, or drop a copy of the destination ('hash')
+    collisions = 'suffix'
+    # What fc.conf holds, saves of an unchanged config are skipped
+    _saved: str = None
+    # Why fc.conf could not be loaded at startup, for the app to show. None when it loaded.
+    load_error: str = None
     filters = [
         Filter('Applications', ['*.exe', '*.msi', '*.dmg', '*.deb', '*.rpm'], 'Applications'),
         Filter('Archives', ['*.zip', '*.rar', '*.7z', '*.tar'], 'Archives'),
@@ -64,41 +166,90 @@ class Config:
         Target("Téléchargements", (home / 'Downloads').as_posix()),
     ]
 
-    def __init__(self):
-        if getattr(sys, 'frozen', False):
+    def __init__(self, exe_path: Path = None):
+        if exe_path is not None:
+            # Explicit folder for fc.conf, used by the benchmarks
+            self.exe_path = Path(exe_path)
+        elif getattr(sys, 'frozen', False):
             # If the application is run as a bundle (e.g., with PyInstaller)
             self.exe_path = Path(sys.executable).parent
         else:
             # If the application is run as a script
             self.exe_path = Path(__file__).parent
 
-        if not os.path.exists(self.exe_path / 'fc.conf'):
+        # The lists are edited in place by the UI, never through the class defaults
+        self.filters = list(self.filters)
+        self.targets = list(self.targets)
+        if not os.path.exists(self.exe_path / CONFIG_FILE):
             self.save()
         else:
-            self.load()
+            try:
+                self.load()
+            except ValueError as e:
+                # Kept aside for the user to fix, the defaults are used meanwhile
+                broken = self.exe_path / (CONFIG_FILE + '.broken')
+                os.replace(self.exe_path / CONFIG_FILE, broken)
+                self.load_error = f'{e}\n\nIt was moved to {broken}, the default settings are used instead.'
+                self.save()
 
     def save(self):
+        # Written to a temporary file first, a crash never leaves a half written fc.conf
+        text = dumps(self.json(), ensure_ascii=False)
+        if text == self._saved:
+            return False
         if not os.path.exists(self.exe_path):
             os.makedirs(self.exe_path, exist_ok=True)
-        with open(self.exe_path / 'fc.conf', 'w', encoding="utf-8") as f:
-            f.write(dumps(self.json(), ensure_ascii=False))
+        file = self.exe_path / CONFIG_FILE
+        temp = file.with_name(file.name + '.tmp')
+        with open(temp, 'w', encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, file)
+        self._saved = text
+        return True
 
     def load(self):
         if not os.path.exists(self.exe_path):
             os.makedirs(self.exe_path, exist_ok=True)
-        with open(self.exe_path / 'fc.conf', 'r', encoding="utf-8") as f:
+        with open(self.exe_path / CONFIG_FILE, 'r', encoding="utf-8") as f:
             content = f.read().strip()
             if not content:
                 self.save()
                 return
-            data = loads(content)
+            try:
+                data = loads(content)
+            except ValueError as e:
+                raise ValueError(f'Invalid {CONFIG_FILE}: {e}') from e
+            validate(data)
             self.theme = data['theme']
             self.filters = [Filter.from_json(filter) for filter in data['filters']]
             self.targets = [Target.from_json(target) for target in data['targets']]
+            self.move_workers = data.get('move_workers', Config.move_workers)
+            self.moves_per_target = data.get('moves_per_target', Config.moves_per_target)
+            self.moves_per_device = data.get('moves_per_device', Config.moves_per_device)
+            self.scan_index = data.get('scan_index', Config.scan_index)
+            self.classify_processes = data.get('classify_processes', Config.classify_processes)
+            self.content_workers = data.get('content_workers', Config.content_workers)
+            self.dedupe = data.get('dedupe', Config.dedupe)
+            self.hash_workers = data.get('hash_workers', Config.hash_workers)
+            self.filter_cache = data.get('filter_cache', Config.filter_cache)
+            self.collisions = data.get('collisions', Config.collisions)
+            self._saved = dumps(self.json(), ensure_ascii=False)
 
     def json(self):
         return {
             'theme': self.theme,
             'filters': [filter.json() for filter in self.filters],
-            'targets': [target.json() for target in self.targets]
+            'targets': [target.json() for target in self.targets],
+            'move_workers': self.move_workers,
+            'moves_per_target': self.moves_per_target,
+            'moves_per_device': self.moves_per_device,
+            'scan_index': self.scan_index,
+            'classify_processes': self.classify_processes,
+            'content_workers': self.content_workers,
+            'dedupe': self.dedupe,
+            'hash_workers': self.hash_workers,
+            'filter_cache': self.filter_cache,
+            'collisions': self.collisions
         }
\ No newline at end of file
@@ -0,0 +1,187 @@
+import os, re
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from fnmatch import translate
+from json import dumps, loads
+from pathlib import Path
+
+# Filter expressions starting with this match the sniffed content type instead of the name
+CONTENT_PREFIX = 'mime:'
+# Bytes read from the start of a file, enough for every signature below
+HEADER_SIZE = 512
+CACHE_FILE = 'fc.content.json'
+CACHE_ENTRIES = 100_000
+UNKNOWN = 'application/octet-stream'
+
+# (offset, magic bytes, content type), checked in order
+SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'\x00\x00\x01\x00', 'image/x-icon'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'{\\rtf', 'application/rtf'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BZh', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b'\x28\xb5\x2f\xfd', 'application/zstd'),
+    (257, b'ustar', 'application/x-tar'),
+    (0, b'\x7fELF', 'application/x-executable'),
+    (0, b'MZ', 'application/vnd.microsoft.portable-executable'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+    (0, b'SQLite format 3\x00', 'application/vnd.sqlite3'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'\x1aE\xdf\xa3', 'video/x-matroska'),
+]
+RIFF_TYPES = {b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo', b'WEBP': 'image/webp'}
+FTYP_TYPES = {b'M4A ': 'audio/mp4', b'heic': 'image/heic', b'heix': 'image/heic', b'avif': 'image/avif', b'qt  ': 'video/quicktime'}
+# Office and e-book formats are zip files, told apart by the first entry names
+ZIP_TYPES = [
+    (b'word/', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    (b'xl/', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    (b'ppt/', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+    (b'mimetypeapplication/epub+zip', 'application/epub+zip'),
+    (b'AndroidManifest.xml', 'application/vnd.android.package-archive'),
+]
+
+def sniff_header(header: bytes):
+    if header.startswith(b'PK\x03\x04'):
+        for marker, content_type in ZIP_TYPES:
+            if marker in header:
+                return content_type
+        return 'application/zip'
+    if header.startswith(b'RIFF') and header[8:12] in RIFF_TYPES:
+        return RIFF_TYPES[header[8:12]]
+    if header[4:8] == b'ftyp':
+        return FTYP_TYPES.get(header[8:12], 'video/mp4')
+    if header.startswith(b'\x1aE\xdf\xa3') and b'webm' in header:
+        return 'video/webm'
+    for offset, magic, content_type in SIGNATURES:
+        if header.startswith(magic, offset):
+            return content_type
+    if len(header) >= 2 and header[0] == 0xff and header[1] & 0xe0 == 0xe0:
+        return 'audio/mpeg'
+    if not header:
+        return 'application/x-empty'
+    if b'\x00' not in header:
+        start = header.lstrip()[:64].lower()
+        if start.startswith(b'#!'):
+            return 'text/x-script'
+        if start.startswith((b'<!doctype html', b'<html')):
+            return 'text/html'
+        if start.startswith(b'<svg') or (start.startswith(b'<?xml') and b'<svg' in header):
+            return 'image/svg+xml'
+        if start.startswith(b'<?xml'):
+            return 'text/xml'
+        try:
+            # A multi-byte character may be cut at the end of the header
+            header.decode('utf-8')
+        except UnicodeDecodeError as e:
+            if e.start < len(header) - 3:
+                return UNKNOWN
+        return 'text/plain'
+    return UNKNOWN
+
+def sniff(file: str):
+    try:
+        with open(file, 'rb') as f:
+            return sniff_header(f.read(HEADER_SIZE))
+    except OSError:
+        return None
+
+def content_pattern(expression: str):
+    # 'mime:image/*' -> compiled glob over the content type, None for a name expression
+    if not expression.lower().startswith(CONTENT_PREFIX):
+        return None
+    return re.compile(translate(expression[len(CONTENT_PREFIX):].strip().lower()))
+
+# What was learned from the content of files, keyed by what changes when the file does:
+# content types here, hashes for the duplicate detection. Least recently used entries
+# are dropped past max_entries.
+class ContentCache:
+    def __init__(self, folder: Path, max_entries: int = CACHE_ENTRIES, name: str = CACHE_FILE):
+        self.file = folder / name
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, object] = OrderedDict()
+        self.changed = False
+        try:
+            with open(self.file, 'r', encoding='utf-8') as f:
+                self.entries = OrderedDict(loads(f.read()))
+        except (OSError, ValueError, TypeError):
+            pass
+
+    @staticmethod
+    def key(stat: os.stat_result, file: str):
+        # Stats from a Windows directory listing carry no inode number, the path stands in for it
+        inode = stat.st_ino or os.path.normcase(file)
+        return f'{stat.st_dev}:{inode}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def get(self, key: str):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        temp = self.file.with_name(self.file.name + '.tmp')
+        with open(temp, 'w', encoding='utf-8') as f:
+            # Oldest first, the order is the LRU order once loaded again
+            f.write(dumps(list(self.entries.items())))
+        os.replace(temp, self.file)
+        self.changed = False
+
+# Reads file headers on a thread pool, only for files the cache does not know yet
+class ContentClassifier:
+    def __init__(self, folder: Path, workers: int = 8):
+        self.cache = ContentCache(folder)
+        self.workers = workers
+        self._executor: ThreadPoolExecutor = None
+        self.read = 0
+
+    def submit(self, file: str, stat=None) -> Future:
+        # The future gives (cache key, content type), the type is None when the file cannot be read.
+        # stat is the one taken by the scan, if any.
+        future = Future()
+        if stat is None:
+            try:
+                stat = os.lstat(file)
+            except OSError:
+                future.set_result((None, None))
+                return future
+        key = ContentCache.key(stat, file)
+        content_type = self.cache.get(key)
+        if content_type is not None:
+            future.set_result((key, content_type))
+            return future
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sniffer')
+        self.read += 1
+        return self._executor.submit(lambda: (key, sniff(file)))
+
+    def learn(self, key: str, content_type: str):
+        # Called from the thread consuming the futures, the cache is not shared with the pool
+        if key is not None and content_type is not None and self.cache.entries.get(key) != content_type:
+            self.cache.put(key, content_type)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.cache.save()
@@ -0,0 +1,110 @@
+import re
+from datetime import datetime, timedelta
+
+# Target.schedule is either an interval ('90s', '15m', '2h', '1d', plain seconds)
+# or a cron expression ('*/15 * * * *': minute hour day month weekday, 0 or 7 is Sunday).
+
+INTERVAL_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+INTERVAL_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhd]?)$')
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+}
+# (lowest, highest) of each cron field
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+# Far enough for any valid expression, e.g. the 29th of February on a given weekday
+CRON_SEARCH_DAYS = 366 * 28
+
+class IntervalSchedule:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def first_run(self, now: datetime) -> datetime:
+        # Right away, then every interval
+        return now
+
+    def next_run(self, last: datetime) -> datetime:
+        return last + timedelta(seconds=self.seconds)
+
+    def __str__(self):
+        return f'every {self.seconds:g}s'
+
+def _cron_field(text: str, lowest: int, highest: int) -> set[int]:
+    values = set()
+    for part in text.split(','):
+        span, slash, step = part.partition('/')
+        step = int(step) if slash else 1
+        if span == '*':
+            start, end = lowest, highest
+        elif '-' in span:
+            start, end = (int(value) for value in span.split('-', 1))
+        else:
+            start = int(span)
+            # '5/10' runs from 5 to the end of the range
+            end = highest if slash else start
+        if step < 1 or start < lowest or end > highest or start > end:
+            raise ValueError(f'{part} is out of {lowest}-{highest}')
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    def __init__(self, expression: str):
+        expression = CRON_ALIASES.get(expression, expression)
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError('a cron expression has 5 fields: minute hour day month weekday')
+        minutes, hours, days, months, weekdays = (
+            _cron_field(field, lowest, highest) for field, (lowest, highest) in zip(fields, CRON_FIELDS)
+        )
+        self.expression = expression
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # Like cron, a day matches either field when both are restricted
+        self.any_day = fields[2] != '*' and fields[4] != '*'
+
+    def _day_matches(self, day: datetime):
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = day.isoweekday() % 7 in self.weekdays
+        return (in_days or in_weekdays) if self.any_day else (in_days and in_weekdays)
+
+    def first_run(self, now: datetime) -> datetime:
+        return self.next_run(now)
+
+    def next_run(self, last: datetime) -> datetime:
+        # First matching minute strictly after last
+        start = last.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(CRON_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        moment = day.replace(hour=hour, minute=minute)
+                        if moment >= start:
+                            return moment
+            day += timedelta(days=1)
+        raise ValueError(f'{self.expression} never runs')
+
+    def __str__(self):
+        return self.expression
+
+def parse_schedule(text: str):
+    # Raises ValueError for anything that is neither an interval nor a cron expression
+    text = text.strip()
+    match = INTERVAL_RE.match(text.lower())
+    if match:
+        seconds = float(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+        if seconds <= 0:
+            raise ValueError('the interval must be longer than 0')
+        return IntervalSchedule(seconds)
+    try:
+        return CronSchedule(text)
+    except ValueError as e:
+        raise ValueError(f'{text!r} is not an interval (e.g. 30m) nor a cron expression: {e}') from e
@@ -0,0 +1,184 @@
+import hashlib, os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Callable
+from content import ContentCache
+from mover import default_move_file
+
+# What to do with the copies of a file found in the same run
+DEDUPE_MODES = ('move', 'hardlink')
+# Copies are moved here, inside their target, in the 'move' mode
+DUPLICATES_FOLDER = 'Duplicates'
+HASH_CACHE_FILE = 'fc.hashes.json'
+HASH_CACHE_ENTRIES = 100_000
+# Hashed at both ends of same sized files, most of them differ there already
+BLOCK_SIZE = 64 * 1024
+# Full hashes are built from the hashes of chunks read in parallel
+CHUNK_SIZE = 16 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+# Smaller files cost more to hash than to move twice
+MIN_SIZE = 64 * 1024
+
+def partial_hash(file: str, size: int) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file, 'rb') as f:
+        digest.update(f.read(BLOCK_SIZE))
+        if size > BLOCK_SIZE:
+            # Up to two blocks, both ends together are the whole file
+            f.seek(max(BLOCK_SIZE, size - BLOCK_SIZE))
+            digest.update(f.read(BLOCK_SIZE))
+    return digest.hexdigest()
+
+def chunk_hash(file: str, offset: int) -> bytes:
+    # hashlib releases the GIL on large updates, chunks of one file are hashed side by side
+    digest = hashlib.blake2b(digest_size=32)
+    with open(file, 'rb', buffering=0) as f:
+        f.seek(offset)
+        remaining = CHUNK_SIZE
+        while remaining:
+            data = f.read(min(remaining, READ_SIZE))
+            if not data:
+                break
+            digest.update(data)
+            remaining -= len(data)
+    return digest.digest()
+
+def combine(size: int, chunks: list[bytes]) -> str:
+    digest = hashlib.blake2b(str(size).encode(), digest_size=32)
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+# Groups files with the same content: by size, then by the hash of their first and last
+# blocks, then by a full hash. Each stage only reads the files the previous one left
+# in a group, and hashes are cached by device, inode, size and mtime.
+class DuplicateFinder:
+    def __init__(self, folder: Path, workers: int = 4):
+        self.cache = ContentCache(folder, HASH_CACHE_ENTRIES, HASH_CACHE_FILE)
+        self.workers = workers
+        # Bytes hashed by this finder, cached hashes excluded
+        self.read = 0
+
+    def groups(self, candidates: list[tuple[object, str, os.stat_result]]) -> list[list]:
+        # candidates are (item, path, stat), each group holds the candidates with the same content
+        by_size: dict[int, list] = {}
+        for candidate in candidates:
+            by_size.setdefault(candidate[2].st_size, []).append(candidate)
+        groups = [group for group in by_size.values() if len(group) > 1]
+        if not groups:
+            return []
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher') as executor:
+            # cache key -> partial hash, the cache may have evicted it by the full hash stage
+            partials: dict[str, str] = {}
+            groups = self._split(groups, executor, 0, partials)
+            groups = self._split(groups, executor, 1, partials)
+        return groups
+
+    def close(self):
+        self.cache.save()
+
+    def _split(self, groups: list[list], executor: ThreadPoolExecutor, stage: int, partials: dict[str, str]) -> list[list]:
+        # stage 0 is the partial hash, 1 the full one. Every read of the stage is
+        # submitted before the first result is waited for.
+        hashes = [[self._hash(file, stat, executor, stage, partials) for _, file, stat in group] for group in groups]
+
+        split = []
+        for group, results in zip(groups, hashes):
+            by_hash: dict[str, list] = {}
+            for candidate, (key, result) in zip(group, results):
+                try:
+                    value = result()
+                except OSError:
+                    # Unreadable now, it is moved like any other file
+                    continue
+                self._learn(key, candidate[2], stage, value)
+                if stage == 0:
+                    partials[key] = value
+                by_hash.setdefault(value, []).append(candidate)
+            split.extend(same for same in by_hash.values() if len(same) > 1)
+        return split
+
+    def _hash(self, file: str, stat: os.stat_result, executor: ThreadPoolExecutor, stage: int, partials: dict[str, str]) -> tuple[str, Callable[[], str]]:
+        # Returns the cache key and a callable waiting for the hash
+        key = ContentCache.key(stat, file)
+        cached = self.cache.get(key)
+        size = stat.st_size
+        if cached is not None and cached[stage] is not None:
+            return key, lambda: cached[stage]
+        if stage == 0:
+            self.read += min(size, 2 * BLOCK_SIZE)
+            return key, executor.submit(partial_hash, file, size).result
+        if size <= 2 * BLOCK_SIZE:
+            # The partial hash already covered every byte
+            value = partials[key]
+            return key, lambda: value
+        self.read += size
+        chunks = [executor.submit(chunk_hash, file, offset) for offset in range(0, size, CHUNK_SIZE)]
+        return key, lambda: combine(size, [chunk.result() for chunk in chunks])
+
+    def _learn(self, key: str, stat: os.stat_result, stage: int, value: str):
+        cached = list(self.cache.get(key) or (None, None))
+        if cached[stage] != value:
+            cached[stage] = value
+            if stage == 0 and stat.st_size <= 2 * BLOCK_SIZE:
+                cached[1] = value
+            self.cache.put(key, cached)
+
+def _same_file(stat: os.stat_result, expected: os.stat_result):
+    return stat.st_size == expected.st_size and stat.st_mtime_ns == expected.st_mtime_ns
+
+# A move_file for the MoveScheduler: duplicates registered with add() become hardlinks
+# to the copy kept at its destination, anything else is moved as usual. A duplicate
+# whose kept copy did not make it there, or on a filesystem without hardlinks, is moved.
+class DuplicateLinker:
+    def __init__(self, move_file=None):
+        self.move_file = move_file or default_move_file
+        # duplicate source -> (kept copy destination, kept copy stat, duplicate stat)
+        self.links: dict[str, tuple[str, os.stat_result, os.stat_result]] = {}
+        self.linked = 0
+        self.linked_bytes = 0
+        # duplicate source -> stat of the link made for it, which carries the kept copy's mtime
+        self._landed: dict[str, os.stat_result] = {}
+        self._lock = Lock()
+
+    def add(self, source: str, kept: str, kept_stat: os.stat_result, stat: os.stat_result):
+        self.links[source] = (kept, kept_stat, stat)
+
+    def landed(self, source: str) -> os.stat_result:
+        # What sits at the destination of a duplicate replaced with a link, None when it was moved
+        with self._lock:
+            return self._landed.pop(source, None)
+
+    def __call__(self, source: str, destination: str, same_device: bool = True, on_progress=None, replace: bool = False):
+        link = self.links.pop(source, None)
+        if link is None or replace:
+            return self.move_file(source, destination, same_device, on_progress, replace)
+        kept, kept_stat, stat = link
+        try:
+            # Both copies must still be what was hashed, the source is deleted below
+            if not _same_file(os.lstat(source), stat):
+                return 'changed since'
+        except FileNotFoundError:
+            return 'no longer exists'
+        try:
+            if not _same_file(os.lstat(kept), kept_stat):
+                return self.move_file(source, destination, same_device, on_progress)
+            os.link(kept, destination)
+        except FileExistsError:
+            # Taken since the folder was listed, the scheduler picks another name
+            self.links[source] = link
+            return 'destination exists'
+        except OSError:
+            return self.move_file(source, destination, same_device, on_progress)
+        try:
+            os.unlink(source)
+        except OSError:
+            os.unlink(destination)
+            return 'in use'
+        with self._lock:
+            self.linked += 1
+            self.linked_bytes += stat.st_size
+            self._landed[source] = kept_stat
+        return None
@@ -0,0 +1,180 @@
+import argparse, signal, sys
+from json import dumps
+from pathlib import Path
+from threading import Event
+from time import monotonic
+from config import Config
+
+# Headless entry point, run with `python -m foldercleaner clean`.
+# Nothing imported from here may pull in PyQt6 or qt_material.
+
+class TextProgress:
+    def __init__(self, stream=None, interval: float = 1.0):
+        # No stream keeps the run silent
+        self.stream = stream
+        self.interval = interval
+        self.value = 0
+        self.size = 0
+        self.label = ''
+        self._last_print = 0.0
+
+    def setLabelText(self, text):
+        self.label = text
+        self._print(force=True)
+
+    def setMaximum(self, value):
+        pass
+
+    def setValue(self, value):
+        self.value = value
+
+    def increment(self, value=1, size=0):
+        self.value += value
+        self.size += size
+        self._print()
+
+    def _print(self, force=False):
+        if self.stream is None:
+            return
+        now = monotonic()
+        if force or now - self._last_print >= self.interval:
+            self._last_print = now
+            print(f'{self.label} ({self.value} files, {self.size / 1024 / 1024:.0f} MB)', file=self.stream, flush=True)
+
+def print_report(report, as_json: bool):
+    if as_json:
+        print(dumps(report.json(), ensure_ascii=False))
+    else:
+        print(report.summary())
+
+def cancel_on_interrupt():
+    # The first Ctrl+C stops the run between files, a second one stops it right away
+    cancel = Event()
+
+    def interrupt(signum, frame):
+        if cancel.is_set():
+            raise KeyboardInterrupt
+        cancel.set()
+
+    signal.signal(signal.SIGINT, interrupt)
+    return cancel
+
+def clean(config: Config, args):
+    from helper import clean_folders
+    if args.dedupe:
+        config.dedupe = None if args.dedupe == 'off' else args.dedupe
+    if args.collisions:
+        config.collisions = args.collisions
+    progress = TextProgress(sys.stderr if args.progress else None)
+    report = clean_folders(config, progress, cancel=cancel_on_interrupt())
+    print_report(report, args.json)
+    return 0
+
+def plan(config: Config, args):
+    from helper import plan_folders
+    progress = TextProgress(sys.stderr if args.progress else None)
+    move_plan = plan_folders(config, progress)
+    if args.output:
+        move_plan.save(Path(args.output))
+    if args.json and not args.output:
+        print(dumps(move_plan.json(), ensure_ascii=False))
+    else:
+        print(progress.label)
+    return 0
+
+def execute(config: Config, args):
+    from helper import execute_plan
+    from plan import MovePlan
+    progress = TextProgress(sys.stderr if args.progress else None)
+    report = execute_plan(config, MovePlan.load(Path(args.plan)), progress, cancel=cancel_on_interrupt())
+    print_report(report, args.json)
+    return 0
+
+def undo(config: Config, args):
+    from helper import undo_last_run
+    progress = TextProgress(sys.stderr if args.progress else None)
+    try:
+        report = undo_last_run(config, progress, cancel=cancel_on_interrupt())
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print_report(report, args.json)
+    return 0
+
+def resume(config: Config, args):
+    from helper import resume_run
+    progress = TextProgress(sys.stderr if args.progress else None)
+    try:
+        report = resume_run(config, progress, cancel=cancel_on_interrupt())
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print_report(report, args.json)
+    return 0
+
+def watch(config: Config, args):
+    from watcher import FolderWatcher
+    progress = TextProgress(sys.stderr if args.progress else None)
+    stop = Event()
+
+    def on_report(report):
+        if report.moved or report.skipped:
+            print_report(report, args.json)
+
+    try:
+        FolderWatcher(config, settle=args.settle).run(progress, stop, on_report)
+    except KeyboardInterrupt:
+        stop.set()
+    return 0
+
+def schedule(config: Config, args):
+    from scheduler import TargetScheduler
+    progress = TextProgress(sys.stderr if args.progress else None)
+
+    def on_report(report):
+        print_report(report, args.json)
+
+    try:
+        # The first Ctrl+C lets the cleaning in progress finish its started moves
+        TargetScheduler(config).run(progress, cancel_on_interrupt(), on_report)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--json', action='store_true', help='print the run report as JSON')
+    common.add_argument('--progress', action='store_true', help='print progress to stderr')
+
+    parser = argparse.ArgumentParser(prog='foldercleaner', description='Sort the files of the configured targets without the GUI.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    clean_parser = commands.add_parser('clean', parents=[common], help='clean every target once')
+    clean_parser.add_argument('--dedupe', choices=['off', 'move', 'hardlink'], help='what to do with copies of the same file, overrides the config')
+    clean_parser.add_argument('--collisions', choices=['suffix', 'skip', 'newer', 'hash'], help='what to do when a destination name is taken, overrides the config')
+
+    plan_parser = commands.add_parser('plan', parents=[common], help='list the moves a cleaning would do, without moving anything')
+    plan_parser.add_argument('--output', '-o', help='save the plan to this file to execute it later')
+
+    execute_parser = commands.add_parser('execute', parents=[common], help='apply a plan saved with `plan --output`')
+    execute_parser.add_argument('plan', help='plan file')
+
+    commands.add_parser('resume', parents=[common], help='make the moves an interrupted run did not get to')
+
+    commands.add_parser('undo', parents=[common], help='move the files of the last run back')
+
+    watch_parser = commands.add_parser('watch', parents=[common], help='keep cleaning the targets as files arrive')
+    watch_parser.add_argument('--settle', type=float, default=2.0, help='seconds an entry must stay untouched before it is moved')
+
+    commands.add_parser('schedule', parents=[common], help='clean each target with a schedule when it is due')
+
+    args = parser.parse_args(argv)
+    config = Config()
+    if config.load_error:
+        print(config.load_error, file=sys.stderr)
+    handlers = {'clean': clean, 'plan': plan, 'execute': execute, 'resume': resume, 'undo': undo, 'watch': watch, 'schedule': schedule}
+    return handlers[args.command](config, args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,99 +1,526 @@
-from os import path, listdir
-from pathlib import Path
-from fnmatch import fnmatch
+import re
+from collections import deque
+from copy import copy
+from os import path, lstat, scandir, sep, stat, DirEntry
+from fnmatch import translate
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+from threading import Event
+from typing import Callable, Iterable, Iterator
 from config import Config, Target, Filter
-from ui import MainWindowTab
-import shutil
-
-def is_file_movable(file_path):
-    try:
-        # Try to open the file in append mode
-        with open(file_path, 'a'):
-            pass
-        return True
-    except IOError:
-        return False
+from matcher import get_matcher, get_process_matcher
+from mover import MoveScheduler, MoveResult, DestinationIndex, get_in_use_check, unchanged_check
+from scan_index import ScanIndex
+from plan import MovePlan, PlannedMove, MATCHED, UNMATCHED
+from report import CleaningReport
+from content import ContentClassifier
+from dedupe import DuplicateFinder, DuplicateLinker, DUPLICATES_FOLDER, DEDUPE_MODES, MIN_SIZE
+from journal import MoveJournal, resumable_run, undoable_run, FINISHED, CANCELLED
+from throttle import Throttle
 
-class FileInstance:
-    def __init__(self, file, config:Config, target:Target):
-        self.file = file
-        self.config = config
-        
-        self._target = target
+MB = 1024 * 1024
+# Files whose header is being read at once, the rest of the pipeline waits past this
+MAX_SNIFFING = 256
 
-        self.filter = None
-        self.origin = None
-        self.target = None
+class EntryStat:
+    # The fields of an os.stat_result the pipeline uses. The os.DirEntry and the full
+    # os.stat_result it caches would take several times the memory of the record itself.
+    __slots__ = ('st_mode', 'st_size', 'st_mtime_ns', 'st_ino', 'st_dev')
 
-    def apply_filter(self, filter:Filter):
-        self.filter = filter
-        self.origin = path.join(self._target.path, self.file)
-        self.target = path.join(self._target.path, filter.folder, self.file)
+    def __init__(self, stat):
+        self.st_mode = stat.st_mode
+        self.st_size = stat.st_size
+        self.st_mtime_ns = stat.st_mtime_ns
+        self.st_ino = stat.st_ino
+        self.st_dev = stat.st_dev
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 1e9
 
 class FileInstance:
-    def __init__(self, file, config:Config, target:Target):
+    # One per scanned entry, so it only keeps the name and indexes into config.targets
+    # and config.filters. Paths are built when the file is actually moved, as plain
+    # strings: Path objects cost more than the rename on large runs.
+    __slots__ = ('file', 'target_index', 'filter_index', 'folder', 'stat', 'planned')
+
+    def __init__(self, file: str, target_index: int, stat: EntryStat = None, folder: str = ''):
         self.file = file
-        self.config = config
-        self.target = target
-        self.filter = None
-        self.origin:Path = Path(target.path) / file
-        self.target_path:Path = None
-
-    def apply_filter(self, filter:Filter):
-        self.filter = filter
-        self.target_path = Path(self.target.path) / filter.folder / self.file
-
-def clean_folders(config: Config, window: 'MainWindowTab'):
-    files: list[FileInstance] = []
-
-    window.progress_bar.setValue(0)
-    window.progress_bar.setMaximum(0)
-    window.progress_bar.setLabelText('Looking for files to move...')
-
-    filters_folders = [filter.folder for filter in config.filters]
-
-    for target in config.targets:
-        if path.isdir(target.path):
-            for file in listdir(target.path):
-                full_path = path.join(target.path, file)
-                if path.isdir(full_path) and file in filters_folders:
+        self.target_index = target_index
+        self.filter_index = -1
+        # Subfolder of the target holding the file, '' at its top. Shared by the files of a folder.
+        self.folder = folder
+        # Taken by the scan, None when the file was not scanned (watch mode, plans)
+        self.stat = stat
+        # The PlannedMove this file comes from, its paths are used as they are
+        self.planned: PlannedMove = None
+
+    def target(self, config: Config) -> Target:
+        return config.targets[self.target_index]
+
+    def filter(self, config: Config) -> Filter:
+        return config.filters[self.filter_index] if self.filter_index >= 0 else None
+
+    def origin(self, config: Config) -> str:
+        if self.planned is not None:
+            return self.planned.source
+        if self.folder:
+            return path.join(config.targets[self.target_index].path, self.folder, self.file)
+        return path.join(config.targets[self.target_index].path, self.file)
+
+    def target_path(self, config: Config) -> str:
+        if self.planned is not None:
+            return self.planned.destination
+        return path.join(config.targets[self.target_index].path, config.filters[self.filter_index].folder, self.file)
+
+def _exclude_regex(target: Target):
+    if not target.exclude:
+        return None
+    return re.compile('|'.join(translate(path.normcase(glob)) for glob in target.exclude))
+
+def walk_target(target: Target, filters_folders: set[str], start: str = None, start_depth: int = 0) -> Iterator[tuple[str, DirEntry]]:
+    # Iterative scandir walk over plain strings: no recursion, no Path objects, and the
+    # is_dir checks come from the directory listing, so entries are not stat'ed here.
+    # Yields (folder relative to the target, '' at its top, entry). start walks a single
+    # subfolder of the target, at its depth.
+    root = target.path
+    root_length = len(root.rstrip('/' + sep)) + 1
+    exclude = _exclude_regex(target)
+    # Destination folders of the filters are already sorted, never walk into them
+    pruned = {path.normcase(path.join(root, folder)) for folder in filters_folders}
+
+    stack = [(start or root, start_depth)]
+    while stack:
+        folder, depth = stack.pop()
+        try:
+            entries = scandir(folder)
+        except OSError:
+            continue
+        relative_folder = folder[root_length:]
+        with entries:
+            for entry in entries:
+                if exclude is not None:
+                    relative = entry.path[root_length:]
+                    if sep != '/':
+                        relative = relative.replace(sep, '/')
+                    if exclude.match(path.normcase(entry.name)) or exclude.match(path.normcase(relative)):
+                        continue
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
                     continue
-                file_instance = FileInstance(file, config, target)
-                files.append(file_instance)
+                if is_dir:
+                    if path.normcase(entry.path) in pruned:
+                        continue
+                    if target.recursive:
+                        if target.max_depth is None or depth < target.max_depth:
+                            stack.append((entry.path, depth + 1))
+                        continue
+                yield relative_folder, entry
 
-    window.progress_bar.setMaximum(len(files))
-    window.progress_bar.setValue(0)
-    window.progress_bar.setLabelText('Applying filters...')
-    for file_instance in files:
-        matched = False
-        for filter in config.filters:
-            for expression in filter.expressions:
-                if fnmatch(file_instance.file, expression):
-                    file_instance.apply_filter(filter)
-                    matched = True
-                    break
-            if matched:
+def sorted_folders(config: Config) -> set[str]:
+    # Folders inside the targets that hold sorted files, never scanned nor moved. The duplicates
+    # folder is left alone even with the dedupe stage turned off.
+    return {filter.folder for filter in config.filters} | {DUPLICATES_FOLDER}
+
+def scan_targets(config: Config, index: ScanIndex = None) -> Iterator[FileInstance]:
+    filters_folders = sorted_folders(config)
+
+    for target_index, target in enumerate(config.targets):
+        try:
+            target_stat = stat(target.path)
+        except OSError:
+            continue
+        if not S_ISDIR(target_stat.st_mode):
+            continue
+
+        # The index only knows the top level, subfolders do not change its mtime
+        known = index.get(target) if index and not target.recursive else None
+        if known:
+            # An unchanged directory costs this single stat call
+            if known.is_unchanged(target_stat.st_mtime_ns):
+                continue
+            known.start(target_stat.st_mtime_ns)
+
+        for folder, entry in walk_target(target, filters_folders):
+            if known and known.is_known(entry):
+                continue
+            try:
+                # Free on Windows, where the listing has it. Elsewhere it is the lstat the move needs anyway.
+                entry_stat = EntryStat(entry.stat(follow_symlinks=False))
+            except OSError:
+                continue
+            yield FileInstance(entry.name, target_index, entry_stat, folder)
+
+def filter_matcher(config: Config):
+    return get_matcher(config.filters, config.exe_path if config.filter_cache else None)
+
+def classify_files(config: Config, files: Iterable[FileInstance], content: ContentClassifier = None) -> Iterator[FileInstance]:
+    matcher = filter_matcher(config)
+    if content is None or not matcher.contents:
+        if config.classify_processes > 1:
+            # Only the names go to the processes, the records stay here
+            for file_instance, best in get_process_matcher(matcher, config.classify_processes).match_names(files, _name):
+                if best is not None:
+                    file_instance.filter_index = best[1]
+                yield file_instance
+            return
+        for file_instance in files:
+            filter_index = matcher.match(file_instance.file)
+            if filter_index is not None:
+                file_instance.filter_index = filter_index
+            yield file_instance
+        return
+
+    if config.classify_processes > 1:
+        named = get_process_matcher(matcher, config.classify_processes).match_names(files, _name)
+    else:
+        named = ((file_instance, matcher.match_name(file_instance.file)) for file_instance in files)
+
+    # Files waiting for their header to be read, in the order they were scanned
+    sniffing: deque = deque()
+
+    def finish(file_instance: FileInstance, best, future):
+        key, content_type = future.result()
+        content.learn(key, content_type)
+        filter_index = matcher.match_content(content_type, best) if content_type else (None if best is None else best[1])
+        if filter_index is not None:
+            file_instance.filter_index = filter_index
+        return file_instance
+
+    for file_instance, best in named:
+        entry_stat = file_instance.stat
+        # Only the entries the names leave open are read, folders and links never are
+        if matcher.needs_content(best) and not (entry_stat is not None and (S_ISDIR(entry_stat.st_mode) or S_ISLNK(entry_stat.st_mode))):
+            sniffing.append((file_instance, best, content.submit(file_instance.origin(config), entry_stat)))
+            while sniffing and (sniffing[0][2].done() or len(sniffing) > MAX_SNIFFING):
+                yield finish(*sniffing.popleft())
+            continue
+        if best is not None:
+            file_instance.filter_index = best[1]
+        yield file_instance
+    while sniffing:
+        yield finish(*sniffing.popleft())
+
+def _name(file_instance: FileInstance) -> str:
+    return file_instance.file
+
+def content_classifier(config: Config) -> ContentClassifier:
+    # None when no filter has a content expression, nothing is ever read then
+    if not filter_matcher(config).contents:
+        return None
+    return ContentClassifier(config.exe_path, config.content_workers)
+
+def move_files(config: Config, files: Iterable[FileInstance], progress, on_result: Callable[[MoveResult], None] = None, index: ScanIndex = None, report: CleaningReport = None, journal: MoveJournal = None, cancel: Event = None, move_file=None, throttle: Throttle = None, collisions: str = None, destinations: DestinationIndex = None) -> CleaningReport:
+    report = report or CleaningReport()
+    in_use_checks = {target.path: get_in_use_check(target.in_use_check) for target in config.targets}
+
+    def remember(file_instance: FileInstance, filter_index: int, pending: bool):
+        if index and file_instance.stat is not None:
+            index.get(file_instance.target(config)).record(file_instance.file, file_instance.stat, filter_index, pending)
+
+    # Duplicates replaced with a link carry the kept copy's mtime, an undo compares against that
+    linker = move_file if isinstance(move_file, DuplicateLinker) else None
+
+    def collect(done: list[MoveResult]):
+        for result in done:
+            if journal:
+                size, mtime_ns = result.size, result.mtime_ns
+                landed = linker.landed(str(result.source)) if linker is not None and result.ok else None
+                if landed is not None:
+                    size, mtime_ns = landed.st_size, landed.st_mtime_ns
+                journal.done(result.source, result.error, size, mtime_ns, result.destination, result.collision)
+            report.add(result, result.item.target(config).path, result.item.filter(config).name)
+            if not result.ok:
+                # Left in place, the next run has to try it again
+                remember(result.item, result.item.filter_index, True)
+            if on_result:
+                on_result(result)
+        if done:
+            progress.increment(len(done), sum(result.size for result in done if result.ok))
+
+    def size_of(file_instance: FileInstance):
+        if file_instance.planned is not None:
+            return file_instance.planned.size
+        try:
+            if file_instance.stat is not None:
+                return file_instance.stat.st_size
+            return stat(file_instance.origin(config), follow_symlinks=False).st_size
+        except OSError:
+            return 0
+
+    scheduler = MoveScheduler(
+        config.move_workers, config.moves_per_target, config.moves_per_device, move_file=move_file,
+        thread_initializer=throttle.start_thread if throttle else None, collisions=collisions or config.collisions, destinations=destinations, cancel=cancel
+    )
+    with scheduler:
+        for file_instance in files:
+            # Checked between files, the moves already started are left to finish
+            if cancel is not None and cancel.is_set():
+                report.cancelled = True
                 break
-        window.progress_bar.increment()
+            target = file_instance.target(config)
+            if file_instance.filter_index >= 0:
+                if throttle is not None:
+                    throttle.wait(size_of(file_instance) if throttle.limits_bytes else 0)
+                origin, destination = file_instance.origin(config), file_instance.target_path(config)
+                if journal:
+                    journal.intent(target.path, origin, destination, file_instance.filter(config).name)
+                check = in_use_checks[target.path]
+                planned = file_instance.planned
+                if planned is not None and planned.mtime_ns is not None:
+                    # An unchanged source was not written to recently either, only the strict probe is left to run
+                    check = unchanged_check(planned.size, planned.mtime_ns, check if target.in_use_check == 'strict' else None)
+                scheduler.submit(
+                    target.path, origin, destination, target.max_moves,
+                    check, file_instance.stat, file_instance
+                )
+            else:
+                remember(file_instance, -1, False)
+                report.add_unmatched(target.path)
+                progress.increment()
+            collect(scheduler.poll())
+
+        showing_transfer = False
+
+        def show_transfers():
+            nonlocal showing_transfer
+            transfers = scheduler.transfers()
+            if transfers:
+                source, (done, total) = max(transfers, key=lambda transfer: transfer[1][1])
+                progress.setLabelText(f'Copying {path.basename(source)}: {done / MB:.0f} / {total / MB:.0f} MB')
+                showing_transfer = True
+            elif showing_transfer:
+                progress.setLabelText('Cleaning folders...')
+                showing_transfer = False
+
+        for result in scheduler.join(show_transfers):
+            collect([result])
 
-    window.progress_bar.setMaximum(len(files))
-    window.progress_bar.setValue(0)
-    window.progress_bar.setLabelText('Moving files...')
-    moved_count = 0
+    # Most cancels arrive while waiting for the moves already submitted, which the scheduler drops
+    if scheduler.dropped or (cancel is not None and cancel.is_set()):
+        report.cancelled = True
+    return report
+
+def dedupe_config(config: Config) -> Config:
+    # Copies found by the dedupe stage are moved through a filter of their own, on a copy of the config
+    run_config = copy(config)
+    run_config.filters = list(config.filters) + [Filter(DUPLICATES_FOLDER, [], DUPLICATES_FOLDER)]
+    return run_config
+
+def dedupe_files(config: Config, files: Iterable[FileInstance], finder: DuplicateFinder, progress, report: CleaningReport, linker: DuplicateLinker = None, cancel: Event = None) -> Iterator[FileInstance]:
+    # Files big enough to be worth it are held back until everything was classified, copies
+    # can only be told apart once every size is known. The other files go on right away.
+    candidates = []
     for file_instance in files:
-        if file_instance.filter:
-            target_dir = file_instance.target_path.parent
-            if not target_dir.exists():
-                target_dir.mkdir(parents=True, exist_ok=True)
-            if is_file_movable(file_instance.origin):
-                shutil.move(file_instance.origin, file_instance.target_path)
-            else:
-                print(f"File {file_instance.origin} is currently in use and cannot be moved.")
-            # file_instance.origin.replace(file_instance.target_path)
-            moved_count += 1
-        window.progress_bar.increment()
-
-    window.progress_bar.setLabelText(f'Done! Moved {moved_count} files.')
-    window.progress_bar.setMaximum(100)
-    window.progress_bar.setValue(100)
-    window._toggle_all(True)
\ No newline at end of file
+        if file_instance.filter_index >= 0 and file_instance.stat is not None:
+            entry_stat = file_instance.stat
+            if S_ISREG(entry_stat.st_mode) and entry_stat.st_size >= MIN_SIZE:
+                candidates.append((file_instance, file_instance.origin(config), entry_stat))
+                continue
+        yield file_instance
+
+    groups = []
+    if candidates and not (cancel is not None and cancel.is_set()):
+        progress.setLabelText('Looking for duplicates...')
+        groups = finder.groups(candidates)
+        progress.setLabelText('Cleaning folders...')
+
+    duplicates = []
+    for group in groups:
+        # The oldest copy is kept, 'setup (1).exe' usually came after 'setup.exe'
+        group.sort(key=lambda candidate: (candidate[2].st_mtime_ns, len(candidate[0].file), candidate[0].file))
+        duplicates.extend((group[0], candidate) for candidate in group[1:])
+    held_back = {id(candidate[0]) for _, candidate in duplicates}
+    for file_instance, _, _ in candidates:
+        if id(file_instance) not in held_back:
+            yield file_instance
+
+    # After every kept copy, a hardlink needs its kept copy at its destination
+    for (kept, _, kept_stat), (file_instance, source, entry_stat) in duplicates:
+        report.duplicates += 1
+        report.duplicate_bytes += entry_stat.st_size
+        if linker is not None:
+            linker.add(source, kept.target_path(config), kept_stat, entry_stat)
+        else:
+            file_instance.filter_index = len(config.filters) - 1
+        yield file_instance
+
+def clean_folders(config: Config, progress, on_result: Callable[[MoveResult], None] = None, cancel: Event = None, throttle: Throttle = None, mode: str = 'clean') -> CleaningReport:
+    # Scanning, classifying and moving are chained generators, so the first moves start
+    # right away and only the moves waiting in the scheduler are held in memory.
+    progress.setValue(0)
+    progress.setMaximum(0)
+    progress.setLabelText('Cleaning folders...')
+
+    report = CleaningReport(mode)
+    index = ScanIndex(config.exe_path / 'fc.index', config.filters) if config.scan_index else None
+
+    journal = MoveJournal(config.exe_path, mode)
+    content = content_classifier(config)
+
+    run_config, finder, linker = config, None, None
+    if config.dedupe in DEDUPE_MODES:
+        finder = DuplicateFinder(config.exe_path, config.hash_workers)
+        if config.dedupe == 'hardlink':
+            linker = DuplicateLinker()
+        else:
+            run_config = dedupe_config(config)
+
+    scanned = report.timer.timed('scan', scan_targets(run_config, index))
+    files = report.timer.timed('classify', classify_files(run_config, scanned, content))
+    if finder:
+        files = report.timer.timed('dedupe', dedupe_files(run_config, files, finder, progress, report, linker, cancel))
+    move_files(run_config, files, progress, on_result, index, report, journal, cancel, linker, throttle)
+
+    journal.close(CANCELLED if report.cancelled else FINISHED)
+    if content:
+        content.close()
+    if finder:
+        finder.close()
+    # A cancelled scan did not see every entry, its index would hide them from the next run
+    if index and not report.cancelled:
+        index.save()
+    report.finish()
+    report.write(config.exe_path)
+
+    progress.setLabelText(report.summary())
+    progress.setMaximum(100)
+    progress.setValue(100)
+    return report
+
+def target_files(config: Config, target: Target, names: Iterable[str]) -> Iterator[FileInstance]:
+    # Like scan_targets, for a few known names at the top of a single target. The folders
+    # among them are walked when the target is recursive, like walk_target would.
+    filters_folders = sorted_folders(config)
+    target_index = config.targets.index(target)
+    exclude = _exclude_regex(target)
+    for name in names:
+        if exclude is not None and exclude.match(path.normcase(name)):
+            continue
+        full_path = path.join(target.path, name)
+        try:
+            is_dir = S_ISDIR(lstat(full_path).st_mode)
+        except OSError:
+            continue
+        if is_dir:
+            if name in filters_folders:
+                continue
+            if target.recursive:
+                if target.max_depth is None or target.max_depth > 0:
+                    for folder, entry in walk_target(target, filters_folders, full_path, 1):
+                        try:
+                            entry_stat = EntryStat(entry.stat(follow_symlinks=False))
+                        except OSError:
+                            continue
+                        yield FileInstance(entry.name, target_index, entry_stat, folder)
+                continue
+        yield FileInstance(name, target_index)
+
+def clean_entries(config: Config, target: Target, names: Iterable[str], progress, on_result: Callable[[MoveResult], None] = None, content: ContentClassifier = None, destinations: DestinationIndex = None) -> CleaningReport:
+    report = move_files(config, classify_files(config, target_files(config, target, names), content), progress, on_result, report=CleaningReport('watch'), destinations=destinations)
+    report.finish()
+    return report
+
+def plan_folders(config: Config, progress, cancel: Event = None) -> MovePlan:
+    # Same scan and classification as clean_folders, without touching anything
+    progress.setValue(0)
+    progress.setMaximum(0)
+    progress.setLabelText('Planning...')
+
+    plan = MovePlan()
+    content = content_classifier(config)
+    for file_instance in classify_files(config, scan_targets(config), content):
+        if cancel is not None and cancel.is_set():
+            break
+        entry_stat = file_instance.stat
+        target_path = file_instance.target(config).path
+        if file_instance.filter_index >= 0:
+            plan.moves.append(PlannedMove(
+                target_path, file_instance.origin(config), file_instance.target_path(config),
+                file_instance.filter(config).name, MATCHED, entry_stat.st_size, entry_stat.st_mtime_ns
+            ))
+        else:
+            plan.moves.append(PlannedMove(target_path, file_instance.origin(config), None, None, UNMATCHED, entry_stat.st_size))
+        progress.increment()
+
+    if content:
+        content.close()
+    progress.setLabelText(f'Planned {len(plan.to_move)} of {len(plan.moves)} files ({plan.total_size / MB:.0f} MB).')
+    progress.setMaximum(100)
+    progress.setValue(100)
+    return plan
+
+def plan_config(config: Config, plan: MovePlan) -> Config:
+    # The plan may name targets and filters removed from the config since it was made,
+    # run it against a copy that knows all of them
+    run_config = copy(config)
+    run_config.targets = list(config.targets)
+    run_config.filters = list(config.filters)
+    targets = {target.path for target in config.targets}
+    filters = {filter.name for filter in config.filters}
+    for move in plan.moves:
+        if move.destination is None:
+            continue
+        if move.target not in targets:
+            run_config.targets.append(Target(move.target, move.target))
+            targets.add(move.target)
+        if move.filter not in filters:
+            run_config.filters.append(Filter(move.filter, [], path.dirname(move.destination)))
+            filters.add(move.filter)
+    return run_config
+
+def planned_files(config: Config, plan: MovePlan) -> Iterator[FileInstance]:
+    # config comes from plan_config, every target and filter of the plan is in it
+    targets = {target.path: index for index, target in enumerate(config.targets)}
+    filters = {filter.name: index for index, filter in enumerate(config.filters)}
+    for move in plan.moves:
+        if move.destination is None:
+            continue
+        file_instance = FileInstance(path.basename(move.source), targets[move.target])
+        # The plan already says where everything goes, nothing is classified again
+        file_instance.filter_index = filters[move.filter]
+        file_instance.planned = move
+        yield file_instance
+
+def execute_plan(config: Config, plan: MovePlan, progress, on_result: Callable[[MoveResult], None] = None, cancel: Event = None, mode: str = 'execute') -> CleaningReport:
+    progress.setValue(0)
+    progress.setMaximum(len(plan.to_move))
+    progress.setLabelText({'resume': 'Resuming...', 'undo': 'Undoing last run...'}.get(mode, 'Executing plan...'))
+
+    report = CleaningReport(mode)
+    # The whole plan goes to the journal first, so what is left can be resumed
+    journal = MoveJournal(config.exe_path, mode)
+    journal.intents(plan.to_move)
+
+    run_config = plan_config(config, plan)
+    # An undo never renames nor replaces, a place taken in the meantime keeps the file where it is
+    collisions = 'skip' if mode == 'undo' else None
+    move_files(run_config, planned_files(run_config, plan), progress, on_result, report=report, journal=journal, cancel=cancel, collisions=collisions)
+    journal.close(CANCELLED if report.cancelled else FINISHED)
+    report.finish()
+    report.write(config.exe_path)
+
+    progress.setLabelText(report.summary())
+    progress.setMaximum(100)
+    progress.setValue(100)
+    return report
+
+def resume_run(config: Config, progress, on_result: Callable[[MoveResult], None] = None, cancel: Event = None) -> CleaningReport:
+    # Makes the moves the last run did not get to, from its journal, without scanning again
+    run = resumable_run(config.exe_path)
+    if run is None:
+        raise ValueError('There is no interrupted run to resume.')
+    plan = run.remaining()
+    run.mark_resumed()
+    return execute_plan(config, plan, progress, on_result, cancel, 'resume')
+
+def undo_last_run(config: Config, progress, on_result: Callable[[MoveResult], None] = None, cancel: Event = None) -> CleaningReport:
+    # Moves the files of the last run back, through the same scheduler as any other run.
+    # Files changed or removed since, and places taken in the meantime, are skipped.
+    run = undoable_run(config.exe_path)
+    if run is None:
+        raise ValueError('There is no run to undo.')
+    report = execute_plan(config, run.reversed(), progress, on_result, cancel, 'undo')
+    if not report.cancelled:
+        run.mark_undone()
+    return report
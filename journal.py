@@ -0,0 +1,206 @@
+import os
+from datetime import datetime
+from json import dumps, loads
+from pathlib import Path
+from time import monotonic
+from mover import IDENTICAL
+from plan import MovePlan, PlannedMove, MATCHED
+
+JOURNAL_FOLDER = 'fc.journal'
+# Journals of older runs are deleted past this count
+JOURNALS_KEPT = 20
+# Moves are flushed to the OS before they start, so they survive the app being killed,
+# and fsync'ed at most this often to also survive a power loss
+SYNC_INTERVAL = 1.0
+# Outcomes are only flushed this often, or along with the next move
+FLUSH_INTERVAL = 0.1
+
+# Run states written in the end record
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+RESUMED = 'resumed'
+
+# One JSON line per record:
+#   {"run": started, "mode": mode}                            header
+#   ["i", id, target, source, destination, filter]            a move about to be made
+#   ["d", id, error, size, mtime_ns]                          its outcome, error is null when moved
+#   ["d", id, null, size, mtime_ns, destination, collision]   moved where the planned name was taken
+#   ["e", state]                                              the run is over
+#   ["u"]                                                     the run was undone
+class MoveJournal:
+    def __init__(self, folder: Path, mode: str):
+        self.folder = folder / JOURNAL_FOLDER
+        os.makedirs(self.folder, exist_ok=True)
+        self.started = datetime.now()
+        self.file = self.folder / (self.started.strftime('%Y%m%d-%H%M%S-%f') + '.jsonl')
+        self._f = open(self.file, 'x', encoding='utf-8')
+        self._last_sync = self._last_flush = monotonic()
+        self._next_id = 0
+        # source -> id of the moves written but not done yet
+        self._ids: dict[str, int] = {}
+        self._write({'run': self.started.isoformat(timespec='seconds'), 'mode': mode}, sync=True)
+        _rotate(self.folder)
+
+    def _write(self, record, sync=False, flush=True):
+        self._f.write(dumps(record, ensure_ascii=False) + '\n')
+        now = monotonic()
+        if flush or now - self._last_flush >= FLUSH_INTERVAL:
+            self._f.flush()
+            self._last_flush = now
+        if sync or now - self._last_sync >= SYNC_INTERVAL:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._last_sync = now
+
+    def intent(self, target: str, source: Path, destination: Path, filter: str, flush: bool = True):
+        # Written before the move is started. Moves already written, like the
+        # whole plan of a plan execution, are not written twice.
+        source = str(source)
+        if source in self._ids:
+            return
+        self._ids[source] = self._next_id
+        self._write(['i', self._next_id, target, source, str(destination), filter], flush=flush)
+        self._next_id += 1
+
+    def intents(self, moves: list[PlannedMove]):
+        for move in moves:
+            self.intent(move.target, move.source, move.destination, move.filter, flush=False)
+        self.sync()
+
+    def done(self, source: Path, error: str = None, size: int = 0, mtime_ns: int = None, destination: Path = None, collision: str = None):
+        move_id = self._ids.pop(str(source), None)
+        if move_id is not None:
+            # Size and mtime of what was moved, an undo only moves it back if they still match
+            if error is not None:
+                record = ['d', move_id, error]
+            elif collision is not None:
+                record = ['d', move_id, error, size, mtime_ns, str(destination), collision]
+            else:
+                record = ['d', move_id, error, size, mtime_ns]
+            self._write(record, flush=False)
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_sync = monotonic()
+
+    def close(self, state: str = FINISHED):
+        self._write(['e', state], sync=True)
+        self._f.close()
+
+class JournalRun:
+    def __init__(self, file: Path):
+        self.file = file
+        self.started = None
+        self.mode = None
+        # id -> planned move, in the order they were written
+        self.moves: dict[int, PlannedMove] = {}
+        # id -> error, None when the move was made
+        self.results: dict[int, str] = {}
+        # None while the run has no end record, e.g. when the app was killed
+        self.state = None
+        self.undone = False
+
+    @property
+    def moved(self) -> list[PlannedMove]:
+        return [move for move_id, move in self.moves.items() if move_id in self.results and self.results[move_id] is None]
+
+    def reversed(self) -> MovePlan:
+        # Every move made, back to where it came from, last moved first
+        return MovePlan([
+            PlannedMove(move.target, move.destination, move.source, move.filter, MATCHED, move.size, move.mtime_ns)
+            for move in reversed(self.moved)
+        ])
+
+    def remaining(self) -> MovePlan:
+        # Moves written but never reported, for a resume. Some of them may have been
+        # made just before the app was killed, they come back as 'no longer exists'.
+        return MovePlan([move for move_id, move in self.moves.items() if move_id not in self.results])
+
+    @property
+    def resumable(self):
+        return self.state != FINISHED and self.state != RESUMED and len(self.results) < len(self.moves)
+
+    def mark_resumed(self):
+        self._append(['e', RESUMED])
+
+    def mark_undone(self):
+        self._append(['u'])
+
+    def _append(self, record):
+        # Appends to the journal of a past run
+        with open(self.file, 'a', encoding='utf-8') as f:
+            # Starts on a new line even after a line cut short by a killed run
+            f.write('\n' + dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+def read_journal(file: Path) -> JournalRun:
+    run = JournalRun(file)
+    with open(file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = loads(line)
+            except ValueError:
+                # The last line of a killed run may be cut short
+                continue
+            if isinstance(record, dict):
+                run.started = record.get('run')
+                run.mode = record.get('mode')
+            elif record[0] == 'i':
+                _, move_id, target, source, destination, filter = record
+                run.moves[move_id] = PlannedMove(target, source, destination, filter, MATCHED, 0)
+            elif record[0] == 'd':
+                run.results[record[1]] = record[2]
+                if len(record) > 3 and record[1] in run.moves:
+                    run.moves[record[1]].size = record[3]
+                    run.moves[record[1]].mtime_ns = record[4]
+                if len(record) > 5 and record[1] in run.moves:
+                    run.moves[record[1]].destination = record[5]
+                    if record[6] == IDENTICAL:
+                        # The source was dropped as a copy of the destination, there is nothing to move back
+                        run.results[record[1]] = 'identical to destination'
+            elif record[0] == 'e':
+                run.state = record[1]
+            elif record[0] == 'u':
+                run.undone = True
+    return run
+
+def journal_files(folder: Path) -> list[Path]:
+    # Newest first
+    try:
+        return sorted((folder / JOURNAL_FOLDER).glob('*.jsonl'), reverse=True)
+    except OSError:
+        return []
+
+def resumable_run(folder: Path) -> JournalRun:
+    # The latest run is the only one that can be resumed, later runs may have moved its files already
+    files = journal_files(folder)
+    if not files:
+        return None
+    try:
+        run = read_journal(files[0])
+    except OSError:
+        return None
+    return run if run.resumable else None
+
+def undoable_run(folder: Path) -> JournalRun:
+    # The latest run that moved something and was not undone yet, undo runs excepted
+    for file in journal_files(folder):
+        try:
+            run = read_journal(file)
+        except OSError:
+            continue
+        if run.mode != 'undo' and not run.undone and run.moved:
+            return run
+    return None
+
+def _rotate(folder: Path):
+    files = sorted(folder.glob('*.jsonl'), reverse=True)
+    for file in files[JOURNALS_KEPT:]:
+        try:
+            file.unlink()
+        except OSError:
+            pass
@@ -1,17 +1,23 @@
 import sys
+from multiprocessing import freeze_support
 from ui import MainWindow
 from config import Config
-from PyQt6.QtWidgets import QApplication
+from PyQt6.QtWidgets import QApplication, QMessageBox
 from qt_material import apply_stylesheet, list_themes
 
-app = QApplication(sys.argv)
+# Classification processes are spawned and import this module again, the app only starts here
+if __name__ == '__main__':
+    freeze_support()
+    app = QApplication(sys.argv)
 
-config = Config()
-window = MainWindow(app=app, config=config)
+    config = Config()
+    window = MainWindow(app=app, config=config)
 
-theme = config.theme if config.theme and config.theme in list_themes() else 'dark_blue.xml'
+    theme = config.theme if config.theme and config.theme in list_themes() else 'dark_blue.xml'
 
-apply_stylesheet(app, theme=config.theme)
+    apply_stylesheet(app, theme=config.theme)
 
-window.show()
-app.exec()
\ No newline at end of file
+    window.show()
+    if config.load_error:
+        QMessageBox.warning(window, "Load", config.load_error)
+    app.exec()
\ No newline at end of file
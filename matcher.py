@@ -0,0 +1,244 @@
+import marshal, multiprocessing, os, re, signal
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from pathlib import Path
+from threading import Lock
+from fnmatch import translate
+from typing import Callable, Iterable, Iterator
+from config import Filter
+from content import content_pattern
+
+GLOB_CHARS = set('*?[')
+# Names sent to a classification process at once
+BATCH_SIZE = 8192
+# The translated filters of the last matcher built, loaded instead of translating them again
+MATCHER_CACHE_FILE = 'fc.filters.bin'
+MATCHER_CACHE_VERSION = 1
+
+def _filters_key(filters: list[Filter]):
+    # Filters without expressions at the end never match anything, e.g. the one a dedupe
+    # run adds for the copies it finds, the same matcher serves with or without them
+    key = [tuple(filter.expressions) for filter in filters]
+    while key and not key[-1]:
+        key.pop()
+    return tuple(key)
+
+def _suffix_of(expression: str):
+    # '*.ext' patterns where 'ext' holds no other glob or dot can be looked up by extension
+    if not expression.startswith('*.'):
+        return None
+    suffix = expression[2:]
+    if not suffix or '.' in suffix or GLOB_CHARS.intersection(suffix):
+        return None
+    return suffix
+
+class FilterMatcher:
+    def __init__(self, filters: list[Filter] = None):
+        if filters is None:
+            # Filled in by from_state
+            return
+        self.key = _filters_key(filters)
+
+        # suffix -> (order, filter index), first expression wins
+        self.suffixes: dict[str, tuple[int, int]] = {}
+        # regex group name -> (order, filter index)
+        self.groups: dict[str, tuple[int, int]] = {}
+        # (order, filter index, content type pattern) of the 'mime:' expressions
+        self.contents: list[tuple[int, int, re.Pattern]] = []
+        # order -> filter index, for every expression
+        self.filter_of: list[int] = []
+
+        parts = []
+        order = 0
+        for filter_index, filter in enumerate(filters):
+            for expression in filter.expressions:
+                self.filter_of.append(filter_index)
+                pattern = content_pattern(expression)
+                if pattern is not None:
+                    self.contents.append((order, filter_index, pattern))
+                    order += 1
+                    continue
+                expression = path.normcase(expression)
+                suffix = _suffix_of(expression)
+                if suffix is not None:
+                    self.suffixes.setdefault(suffix, (order, filter_index))
+                else:
+                    group = f'p{order}'
+                    self.groups[group] = (order, filter_index)
+                    parts.append(f'(?P<{group}>{translate(expression)})')
+                order += 1
+
+        self.regex = re.compile('|'.join(parts)) if parts else None
+
+    def state(self):
+        # Plain data only: what is sent to the classification processes and cached by save_matcher
+        return (
+            MATCHER_CACHE_VERSION, self.key, self.suffixes, self.groups,
+            self.regex.pattern if self.regex is not None else None,
+            [(order, filter_index, pattern.pattern) for order, filter_index, pattern in self.contents],
+            self.filter_of
+        )
+
+    @staticmethod
+    def from_state(state) -> 'FilterMatcher':
+        # The regexes still have to be compiled, Python cannot keep a compiled one across runs
+        version, key, suffixes, groups, regex, contents, filter_of = state
+        if version != MATCHER_CACHE_VERSION:
+            raise ValueError(f'Unknown matcher state version {version}')
+        matcher = FilterMatcher()
+        matcher.key = key
+        matcher.suffixes = suffixes
+        matcher.groups = groups
+        matcher.regex = re.compile(regex) if regex is not None else None
+        matcher.contents = [(order, filter_index, re.compile(pattern)) for order, filter_index, pattern in contents]
+        matcher.filter_of = filter_of
+        return matcher
+
+    def match(self, name: str):
+        best = self.match_name(name)
+        return None if best is None else best[1]
+
+    def match_name(self, name: str):
+        # (order, filter index) of the first name expression matching, or None
+        name = path.normcase(name)
+
+        best = None
+        _, dot, suffix = name.rpartition('.')
+        if dot:
+            best = self.suffixes.get(suffix)
+
+        if self.regex is not None:
+            # Alternatives are tried left to right, so this is the first glob that matches
+            m = self.regex.match(name)
+            if m is not None:
+                found = self.groups[m.lastgroup]
+                if best is None or found[0] < best[0]:
+                    best = found
+
+        return best
+
+    def needs_content(self, best):
+        # Only a content expression ordered before the name match can change the result
+        return bool(self.contents) and (best is None or self.contents[0][0] < best[0])
+
+    def match_content(self, content_type: str, best):
+        # Filter index for a sniffed content type, falling back on the name match
+        content_type = content_type.lower()
+        for order, filter_index, pattern in self.contents:
+            if best is not None and order > best[0]:
+                break
+            if pattern.match(content_type):
+                return filter_index
+        return None if best is None else best[1]
+
+# Classification processes. Each one compiles the filters once when it starts,
+# then gets plain lists of names and sends back the order of the expression
+# each name matched (-1 for none) as a compact array.
+
+_worker_matcher: FilterMatcher = None
+
+def _start_worker(state):
+    global _worker_matcher
+    # Ctrl+C reaches the whole process group, only the parent decides what to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_matcher = FilterMatcher.from_state(state)
+
+def _match_batch(names: list[str]) -> array:
+    match_name = _worker_matcher.match_name
+    orders = array('i')
+    for name in names:
+        best = match_name(name)
+        orders.append(-1 if best is None else best[0])
+    return orders
+
+class ProcessMatcher:
+    def __init__(self, matcher: FilterMatcher, processes: int):
+        self.matcher = matcher
+        self.key = (matcher.key, processes)
+        self.processes = processes
+        # Spawned on every platform, forking a process that runs Qt and mover threads is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_start_worker, initargs=(matcher.state(),)
+        )
+
+    def match_names(self, items: Iterable, name: Callable[[object], str]) -> Iterator[tuple[object, tuple[int, int]]]:
+        # Yields (item, (order, filter index) or None) in the order of the items, like
+        # FilterMatcher.match_name. A few batches per process are in flight at once.
+        in_flight: deque = deque()
+        batch = []
+
+        def results(batch: list, future):
+            filter_of = self.matcher.filter_of
+            for item, order in zip(batch, future.result()):
+                yield item, (None if order < 0 else (order, filter_of[order]))
+
+        for item in items:
+            batch.append(item)
+            if len(batch) < BATCH_SIZE:
+                continue
+            in_flight.append((batch, self._executor.submit(_match_batch, [name(item) for item in batch])))
+            batch = []
+            while in_flight and (in_flight[0][1].done() or len(in_flight) > self.processes * 2):
+                yield from results(*in_flight.popleft())
+        if batch:
+            in_flight.append((batch, self._executor.submit(_match_batch, [name(item) for item in batch])))
+        while in_flight:
+            yield from results(*in_flight.popleft())
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+_cached_process_matcher: ProcessMatcher = None
+_process_matcher_lock = Lock()
+
+def get_process_matcher(matcher: FilterMatcher, processes: int) -> ProcessMatcher:
+    # Kept across runs, the processes are only started again when the filters change.
+    # Runs and the watcher may ask for it from different threads.
+    global _cached_process_matcher
+    key = (matcher.key, processes)
+    with _process_matcher_lock:
+        if _cached_process_matcher is None or _cached_process_matcher.key != key:
+            if _cached_process_matcher is not None:
+                _cached_process_matcher.close()
+            _cached_process_matcher = ProcessMatcher(matcher, processes)
+        return _cached_process_matcher
+
+def load_matcher(folder: Path, filters: list[Filter]) -> FilterMatcher:
+    # None when there is no cache or it was made for other filters
+    try:
+        with open(folder / MATCHER_CACHE_FILE, 'rb') as f:
+            state = marshal.load(f)
+        if state[1] != _filters_key(filters):
+            return None
+        return FilterMatcher.from_state(state)
+    except (OSError, EOFError, ValueError, TypeError, IndexError, re.error):
+        return None
+
+def save_matcher(folder: Path, matcher: FilterMatcher):
+    file = folder / MATCHER_CACHE_FILE
+    temp = file.with_name(file.name + '.tmp')
+    try:
+        with open(temp, 'wb') as f:
+            marshal.dump(matcher.state(), f)
+        os.replace(temp, file)
+    except OSError:
+        # Only a cache, the next run translates the filters again
+        pass
+
+_cached_matcher: FilterMatcher = None
+
+def get_matcher(filters: list[Filter], cache_folder: Path = None) -> FilterMatcher:
+    # With a cache folder, a matcher for the same filters is loaded from there
+    # instead of translating every expression again after a restart
+    global _cached_matcher
+    if _cached_matcher is None or _cached_matcher.key != _filters_key(filters):
+        matcher = load_matcher(cache_folder, filters) if cache_folder is not None else None
+        if matcher is None:
+            matcher = FilterMatcher(filters)
+            if cache_folder is not None:
+                save_matcher(cache_folder, matcher)
+        _cached_matcher = matcher
+    return _cached_matcher
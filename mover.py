@@ -0,0 +1,458 @@
+import errno, hashlib, os, shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from stat import S_ISDIR, S_ISREG
+from threading import Event, Lock, Semaphore
+from time import time, perf_counter
+from transfer import move_file_across_devices, rename_no_replace
+
+# Files written to in the last seconds are most likely still being downloaded or saved
+RECENT_WRITE_SECONDS = 2.0
+
+# What to do when the destination name is taken: move as 'name (1).ext', leave the
+# source where it is, replace the destination when the source is 'newer', or drop
+# the source when the destination holds the same content ('hash') and rename otherwise
+COLLISION_POLICIES = ('suffix', 'skip', 'newer', 'hash')
+# How a taken destination was dealt with, in MoveResult.collision
+RENAMED = 'renamed'
+REPLACED = 'replaced'
+IDENTICAL = 'identical'
+# Names taken by someone else between the listing and the move are resolved again this often
+COLLISION_RETRIES = 3
+HASH_READ_SIZE = 1024 * 1024
+
+class MoveResult:
+    def __init__(self, source: str, destination: str, error: str = None, item=None, size: int = 0, duration: float = 0.0, mtime_ns: int = None, collision: str = None):
+        self.source = source
+        # Where the file went, a renamed collision makes it differ from the planned destination
+        self.destination = destination
+        self.error = error
+        # None, RENAMED, REPLACED or IDENTICAL when the destination name was taken
+        self.collision = collision
+        self.size = size
+        # Modification time of the source, kept by the move, to tell later whether it was changed since
+        self.mtime_ns = mtime_ns
+        # Seconds spent in the move itself, waiting for a slot not included
+        self.duration = duration
+        # Whatever the caller submitted along with the move
+        self.item = item
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f'MoveResult({self.source}, {self.destination}, {self.error})'
+
+def _file_hash(file: str) -> bytes:
+    digest = hashlib.blake2b(digest_size=32)
+    with open(file, 'rb', buffering=0) as f:
+        while True:
+            data = f.read(HASH_READ_SIZE)
+            if not data:
+                return digest.digest()
+            digest.update(data)
+
+def suffixed_name(name: str, taken: set[str]) -> str:
+    # 'report.pdf' -> 'report (1).pdf', the first number not in taken
+    stem, extension = os.path.splitext(name)
+    number = 1
+    while os.path.normcase(f'{stem} ({number}){extension}') in taken:
+        number += 1
+    return f'{stem} ({number}){extension}'
+
+# Names in each destination folder, listed once on the first move into it instead of
+# probing every destination, and kept up to date as moves land. Moves into one folder
+# are chained, so a folder's names are only used by one mover thread at a time.
+class DestinationIndex:
+    def __init__(self):
+        # folder -> os.path.normcase'd names
+        self._folders: dict[str, set[str]] = {}
+
+    def names(self, folder: str) -> set[str]:
+        names = self._folders.get(folder)
+        if names is None:
+            try:
+                names = {os.path.normcase(name) for name in os.listdir(folder)}
+            except FileNotFoundError:
+                names = set()
+            self._folders[folder] = names
+        return names
+
+    def moved(self, source: str, destination: str):
+        self.names(os.path.dirname(destination)).add(os.path.normcase(os.path.basename(destination)))
+        # The source folder is only known when something is moved into it too, e.g. by an undo
+        names = self._folders.get(os.path.dirname(source))
+        if names is not None:
+            names.discard(os.path.normcase(os.path.basename(source)))
+
+# Runs moves on a bounded thread pool. Moves into the same destination folder
+# are queued one after the other, while the number of moves running at once
+# is limited per target and per device.
+class MoveScheduler:
+    def __init__(self, max_workers=8, per_target=4, per_device=4, max_pending=1024, move_file=None, thread_initializer=None, collisions='suffix', destinations: DestinationIndex = None, cancel: Event = None):
+        self.max_workers = max_workers
+        self.per_target = per_target
+        self.per_device = per_device
+        self.move_file = move_file or default_move_file
+        # One of COLLISION_POLICIES
+        self.collisions = collisions if collisions in COLLISION_POLICIES else 'suffix'
+        # Can outlive the scheduler, e.g. for the whole watch
+        self.destinations = destinations or DestinationIndex()
+        # Once set, the moves not started yet are dropped without a result, a resume makes them
+        self.cancel = cancel
+        self.dropped = 0
+        # Called on each mover thread as it starts, e.g. to lower its priority
+        self.thread_initializer = thread_initializer
+
+        self._executor: ThreadPoolExecutor = None
+        self._lock = Lock()
+        self._pending = Semaphore(max_pending)
+        # deque appends and pops are atomic, the event only wakes up join()
+        self._results: deque[MoveResult] = deque()
+        self._result_ready = Event()
+        self._submitted = 0
+        self._returned = 0
+
+        # Folders are kept as strings, hashing Path objects costs more than the rename itself
+        # destination folder -> queued (target key, source, destination, check, source stat, item) not yet started
+        self._chains: dict[str, deque] = {}
+        # target key -> folders whose next move waits for a free slot, a move only goes
+        # to the pool once its target and device have one, so no worker sits blocked
+        self._ready: dict[str, deque[str]] = {}
+        self._target_limits: dict[str, int] = {}
+        self._target_running: dict[str, int] = {}
+        self._device_running: dict[int, int] = {}
+        self._running = 0
+        self._devices: dict[str, int] = {}
+        self._created_dirs: set[str] = set()
+        # (source folder, destination folder) -> both on the same device
+        self._same_device: dict[tuple[str, str], bool] = {}
+        # source -> (bytes copied, total bytes) for cross-device copies in progress
+        self._transfers: dict[str, tuple[int, int]] = {}
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='mover', initializer=self.thread_initializer)
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def submit(self, target_path: str, source: str, destination: str, limit: int = None, check=None, source_stat=None, item=None):
+        # Blocks when too many moves are waiting, so callers never queue more than max_pending
+        self._pending.acquire()
+        with self._lock:
+            self._submitted += 1
+            if target_path not in self._target_limits:
+                self._target_limits[target_path] = limit or self.per_target
+                self._target_running[target_path] = 0
+                self._device(target_path)
+            folder = os.path.dirname(str(destination))
+            task = (target_path, source, destination, check, source_stat, item)
+            chain = self._chains.get(folder)
+            if chain is not None:
+                # Queued behind the move running or waiting for this folder
+                chain.append(task)
+                return
+            self._chains[folder] = deque([task])
+            self._ready.setdefault(target_path, deque()).append(folder)
+            self._dispatch()
+
+    def poll(self):
+        # Results finished so far, without waiting
+        results = []
+        while self._results:
+            results.append(self._results.popleft())
+        self._returned += len(results)
+        return results
+
+    def join(self, on_idle=None, interval=0.2):
+        # Yields the remaining results as they complete, on_idle is called while waiting
+        while self._returned + self.dropped < self._submitted:
+            if not self._results:
+                self._result_ready.clear()
+                # A result may have landed between the check and the clear
+                if not self._results and not self._result_ready.wait(interval):
+                    if on_idle:
+                        on_idle()
+                continue
+            self._returned += 1
+            yield self._results.popleft()
+
+    def transfers(self):
+        # Snapshot of the cross-device copies in progress
+        with self._lock:
+            return list(self._transfers.items())
+
+    def _dispatch(self):
+        # Called with the lock held, starts the next move of each waiting folder while
+        # a worker, its target and its device all have a free slot
+        if self.cancel is not None and self.cancel.is_set():
+            for folders in self._ready.values():
+                for folder in folders:
+                    chain = self._chains.pop(folder)
+                    self.dropped += len(chain)
+                    for _ in chain:
+                        self._pending.release()
+                folders.clear()
+            self._result_ready.set()
+            return
+        for target_path, folders in self._ready.items():
+            device = self._devices[target_path]
+            while folders and self._running < self.max_workers \
+                    and self._target_running[target_path] < self._target_limits[target_path] \
+                    and self._device_running.get(device, 0) < self.per_device:
+                folder = folders.popleft()
+                task = self._chains[folder].popleft()
+                self._running += 1
+                self._target_running[target_path] += 1
+                self._device_running[device] = self._device_running.get(device, 0) + 1
+                self._executor.submit(self._run, folder, task)
+            if self._running >= self.max_workers:
+                return
+
+    def _run(self, folder: str, task):
+        target_path, source, destination, check, source_stat, item = task
+        try:
+            result = self._move(target_path, source, destination, check, source_stat)
+        except Exception as e:
+            result = MoveResult(source, destination, str(e))
+        result.item = item
+        self._results.append(result)
+        self._result_ready.set()
+        self._pending.release()
+        with self._lock:
+            self._running -= 1
+            self._target_running[target_path] -= 1
+            self._device_running[self._devices[target_path]] -= 1
+            chain = self._chains[folder]
+            if chain:
+                # The next move may belong to another target sharing the folder
+                self._ready.setdefault(chain[0][0], deque()).append(folder)
+            else:
+                del self._chains[folder]
+            self._dispatch()
+
+    def _move(self, target_path: str, source: str, destination: str, check, source_stat):
+        if check is not None:
+            reason = check(source, source_stat)
+            if reason:
+                return MoveResult(source, destination, reason)
+        try:
+            # Already stat'ed by the scan most of the time
+            stat = source_stat if source_stat is not None else os.lstat(source)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            size, mtime_ns = 0, None
+        start = perf_counter()
+        source, destination = str(source), str(destination)
+        folder = os.path.dirname(destination)
+        if folder not in self._created_dirs:
+            os.makedirs(folder, exist_ok=True)
+            self._created_dirs.add(folder)
+        names = self.destinations.names(folder)
+        try:
+            same_device = self._is_same_device(os.path.dirname(source), folder)
+            for _ in range(COLLISION_RETRIES):
+                moved_to, collision, error = self._resolve(source, destination, names)
+                if error is None and collision != IDENTICAL:
+                    if collision == REPLACED:
+                        error = self.move_file(source, moved_to, same_device, self._transfer_progress(source), True)
+                    else:
+                        error = self.move_file(source, moved_to, same_device, self._transfer_progress(source))
+                if error != 'destination exists' or self.collisions == 'skip':
+                    break
+                # Taken since the folder was listed, known from now on
+                names.add(os.path.normcase(os.path.basename(moved_to)))
+        finally:
+            if self._transfers:
+                with self._lock:
+                    self._transfers.pop(source, None)
+        if error is None:
+            self.destinations.moved(source, moved_to)
+        return MoveResult(source, moved_to, error, size=size, duration=perf_counter() - start, mtime_ns=mtime_ns, collision=collision if error is None else None)
+
+    def _resolve(self, source: str, destination: str, names: set[str]):
+        # (destination to move to, how a taken name was dealt with, skip reason), without
+        # a syscall unless the name is taken
+        name = os.path.basename(destination)
+        if os.path.normcase(name) not in names:
+            return destination, None, None
+        try:
+            destination_stat = os.lstat(destination)
+        except FileNotFoundError:
+            # Removed since the folder was listed
+            names.discard(os.path.normcase(name))
+            return destination, None, None
+        if self.collisions == 'skip':
+            return destination, None, 'destination exists'
+        if self.collisions in ('newer', 'hash'):
+            try:
+                source_stat = os.lstat(source)
+            except FileNotFoundError:
+                return destination, None, 'no longer exists'
+            both_files = S_ISREG(source_stat.st_mode) and S_ISREG(destination_stat.st_mode)
+            if self.collisions == 'newer':
+                if not both_files:
+                    return destination, None, 'destination exists'
+                if source_stat.st_mtime_ns <= destination_stat.st_mtime_ns:
+                    return destination, None, 'destination is newer'
+                return destination, REPLACED, None
+            if both_files and source_stat.st_size == destination_stat.st_size and _file_hash(source) == _file_hash(destination):
+                # Already there, the source is a copy of it
+                try:
+                    os.unlink(source)
+                except PermissionError:
+                    return destination, None, 'in use'
+                return destination, IDENTICAL, None
+        return os.path.join(os.path.dirname(destination), suffixed_name(name, names)), RENAMED, None
+
+    def _transfer_progress(self, source: str):
+        def on_progress(done: int, total: int):
+            with self._lock:
+                self._transfers[source] = (done, total)
+        return on_progress
+
+    def _is_same_device(self, source_folder: str, destination_folder: str):
+        key = (source_folder, destination_folder)
+        same = self._same_device.get(key)
+        if same is None:
+            same = os.stat(source_folder).st_dev == os.stat(destination_folder).st_dev
+            self._same_device[key] = same
+        return same
+
+    def _device(self, target_path: str):
+        # Called with the lock held, once per target
+        device = self._devices.get(target_path)
+        if device is None:
+            try:
+                device = os.stat(target_path).st_dev
+            except OSError:
+                device = -1
+            self._devices[target_path] = device
+        return device
+
+def is_file_movable(file_path):
+    try:
+        # Try to open the file in append mode
+        with open(file_path, 'a'):
+            pass
+        return True
+    except IOError:
+        return False
+
+# In-use checks run before a move and return a skip reason, or None when the move can go ahead.
+# They get the stat taken by the scan when there is one, so it is not taken again.
+
+def fast_in_use_check(source: Path, source_stat=None):
+    try:
+        stat = source_stat if source_stat is not None else os.lstat(source)
+    except FileNotFoundError:
+        return 'no longer exists'
+    if time() - stat.st_mtime < RECENT_WRITE_SECONDS:
+        return 'recently modified'
+    return None
+
+def strict_in_use_check(source: Path, source_stat=None):
+    reason = fast_in_use_check(source, source_stat)
+    if reason:
+        return reason
+    # Opening the file costs a syscall pair per file, but catches writers the rename would not notice
+    return None if is_file_movable(source) else 'in use'
+
+IN_USE_CHECKS = {
+    'fast': fast_in_use_check,
+    'strict': strict_in_use_check,
+}
+
+def get_in_use_check(name: str):
+    return IN_USE_CHECKS.get(name or 'fast', fast_in_use_check)
+
+def unchanged_check(size: int, mtime_ns: int, then=None):
+    # For moves decided earlier (plans, undo): skip the source when it changed in the meantime
+    def check(source: Path, source_stat=None):
+        try:
+            stat = source_stat if source_stat is not None else os.lstat(source)
+        except FileNotFoundError:
+            return 'no longer exists'
+        # A folder moved across devices is rebuilt, its size and mtime never match what was journaled
+        if not S_ISDIR(stat.st_mode) and (stat.st_size != size or stat.st_mtime_ns != mtime_ns):
+            return 'changed since'
+        return then(source, source_stat) if then is not None else None
+    return check
+
+def default_move_file(source: Path, destination: Path, same_device: bool = True, on_progress=None, replace: bool = False):
+    # Never overwrites unless asked to, the rename itself fails on a taken name
+    if same_device:
+        # Try the rename first, a file held open by another process makes it fail
+        try:
+            if replace:
+                os.replace(source, destination)
+            else:
+                rename_no_replace(source, destination)
+            return None
+        except FileExistsError:
+            return 'destination exists'
+        except PermissionError:
+            return 'in use'
+        except FileNotFoundError:
+            return 'no longer exists'
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    try:
+        return copy_move(source, destination, on_progress, replace)
+    except FileExistsError:
+        return 'destination exists'
+
+def copy_move(source: Path, destination: Path, on_progress=None, replace: bool = False):
+    # Cross-device move, the source is only removed once the copy is complete
+    if os.path.isdir(source) and not os.path.islink(source):
+        return move_tree(source, destination, on_progress)
+
+    if os.path.islink(source):
+        shutil.copy2(source, destination, follow_symlinks=False)
+        os.unlink(source)
+        return None
+
+    return move_file_across_devices(source, destination, on_progress, replace)
+
+def move_tree(source: Path, destination: Path, on_progress=None):
+    # Cross-device folder move, file by file: each source file is only removed once its copy
+    # checked out, so a failure part way leaves every file either moved or still in the source
+    os.mkdir(destination)
+    moved = left = 0
+    for folder, folders, files in os.walk(source):
+        relative = os.path.relpath(folder, source)
+        target_folder = destination if relative == os.curdir else os.path.join(destination, relative)
+        # Links to folders are listed with the folders, they are moved as links
+        links = [name for name in folders if os.path.islink(os.path.join(folder, name))]
+        for name in folders:
+            if name not in links:
+                os.makedirs(os.path.join(target_folder, name), exist_ok=True)
+        for name in links + files:
+            file, target = os.path.join(folder, name), os.path.join(target_folder, name)
+            try:
+                if os.path.islink(file):
+                    shutil.copy2(file, target, follow_symlinks=False)
+                    os.unlink(file)
+                    error = None
+                else:
+                    error = move_file_across_devices(file, target, on_progress)
+            except OSError:
+                error = 'failed'
+            if error is None:
+                moved += 1
+            else:
+                left += 1
+    # Folders left empty go from the side that no longer holds the files, nothing is lost either way
+    for folder, _, _ in os.walk(source if moved else destination, topdown=False):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+    if not left:
+        return None
+    return 'partially moved' if moved else 'in use'
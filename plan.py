@@ -0,0 +1,71 @@
+import os
+from datetime import datetime
+from json import dumps, loads
+from pathlib import Path
+
+MATCHED = 'matched'
+UNMATCHED = 'no matching filter'
+
+class PlannedMove:
+    def __init__(self, target: str, source: str, destination: str, filter: str, reason: str, size: int, mtime_ns: int = None):
+        self.target = target
+        self.source = source
+        # None when the entry stays where it is
+        self.destination = destination
+        self.filter = filter
+        self.reason = reason
+        self.size = size
+        # Source modification time when the move was decided, the move is skipped if it changed since
+        self.mtime_ns = mtime_ns
+
+    @staticmethod
+    def from_json(data):
+        return PlannedMove(data['target'], data['source'], data['destination'], data['filter'], data['reason'], data['size'], data.get('mtime_ns'))
+
+    def json(self):
+        return {
+            'target': self.target,
+            'source': self.source,
+            'destination': self.destination,
+            'filter': self.filter,
+            'reason': self.reason,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns
+        }
+
+    def __repr__(self):
+        return f'PlannedMove({self.source}, {self.destination}, {self.filter})'
+
+class MovePlan:
+    def __init__(self, moves: list[PlannedMove] = None, created: str = None):
+        self.moves = moves if moves is not None else []
+        self.created = created or datetime.now().isoformat(timespec='seconds')
+
+    @property
+    def to_move(self):
+        return [move for move in self.moves if move.destination is not None]
+
+    @property
+    def total_size(self):
+        return sum(move.size for move in self.moves if move.destination is not None)
+
+    @staticmethod
+    def from_json(data):
+        return MovePlan([PlannedMove.from_json(move) for move in data['moves']], data.get('created'))
+
+    def json(self):
+        return {
+            'created': self.created,
+            'moves': [move.json() for move in self.moves]
+        }
+
+    def save(self, file: Path):
+        temp = Path(str(file) + '.tmp')
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(dumps(self.json(), ensure_ascii=False))
+        os.replace(temp, file)
+
+    @staticmethod
+    def load(file: Path):
+        with open(file, 'r', encoding='utf-8') as f:
+            return MovePlan.from_json(loads(f.read()))
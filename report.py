@@ -0,0 +1,173 @@
+import heapq
+from collections import deque
+from datetime import datetime
+from json import dumps, loads
+from pathlib import Path
+from time import perf_counter
+from typing import Iterable, Iterator
+
+REPORT_FILE = 'fc.runs.jsonl'
+SLOWEST_MOVES = 10
+# Sources kept per skip reason, the counts are always complete
+SKIPPED_SAMPLES = 100
+
+class PhaseTimer:
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    def timed(self, phase: str, iterable: Iterable) -> Iterator:
+        # Time spent producing each item, including the stages feeding this one
+        iterator = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, perf_counter() - start)
+                return
+            self.add(phase, perf_counter() - start)
+            yield item
+
+class CleaningReport:
+    def __init__(self, mode: str = 'clean'):
+        self.mode = mode
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self._start = perf_counter()
+        self.timer = PhaseTimer()
+        self.wall = None
+        # Stopped before every file was handled
+        self.cancelled = False
+
+        self.moved = 0
+        self.moved_bytes = 0
+        self.unmatched = 0
+        # Copies of another file of the run, and their size, found by the dedupe stage
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+        # renamed, replaced or identical -> moves whose destination name was taken
+        self.collisions: dict[str, int] = {}
+        # skip reason -> number of entries, and a few of their sources
+        self.skipped: dict[str, int] = {}
+        self.skipped_samples: dict[str, list[str]] = {}
+        # target path -> {'moved', 'skipped', 'unmatched'}
+        self.targets: dict[str, dict[str, int]] = {}
+        # filter name -> files moved
+        self.filters: dict[str, int] = {}
+        # min-heap of (seconds, sequence, move) holding the slowest moves
+        self._slowest: list = []
+        self._sequence = 0
+
+    def _target(self, target_path: str):
+        counts = self.targets.get(target_path)
+        if counts is None:
+            counts = self.targets[target_path] = {'moved': 0, 'skipped': 0, 'unmatched': 0}
+        return counts
+
+    def add_unmatched(self, target_path: str):
+        self.unmatched += 1
+        self._target(target_path)['unmatched'] += 1
+
+    def add(self, result, target_path: str = None, filter_name: str = None):
+        if result.ok:
+            self.moved += 1
+            self.moved_bytes += result.size
+            if target_path is not None:
+                self._target(target_path)['moved'] += 1
+            if filter_name is not None:
+                self.filters[filter_name] = self.filters.get(filter_name, 0) + 1
+            if result.collision is not None:
+                self.collisions[result.collision] = self.collisions.get(result.collision, 0) + 1
+            self._sequence += 1
+            move = (result.duration, self._sequence, str(result.source), str(result.destination), result.size)
+            if len(self._slowest) < SLOWEST_MOVES:
+                heapq.heappush(self._slowest, move)
+            elif move[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, move)
+        else:
+            self.skipped[result.error] = self.skipped.get(result.error, 0) + 1
+            samples = self.skipped_samples.setdefault(result.error, [])
+            if len(samples) < SKIPPED_SAMPLES:
+                samples.append(str(result.source))
+            if target_path is not None:
+                self._target(target_path)['skipped'] += 1
+
+    def finish(self):
+        self.wall = perf_counter() - self._start
+
+    @property
+    def skipped_count(self):
+        return sum(self.skipped.values())
+
+    @property
+    def phases(self):
+        # Each stage is timed with the stages that feed it, keep only its own share
+        scan = self.timer.seconds.get('scan', 0.0)
+        classify = max(0.0, self.timer.seconds.get('classify', 0.0) - scan)
+        wall = self.wall if self.wall is not None else perf_counter() - self._start
+        phases = {'scan': scan, 'classify': classify}
+        if 'dedupe' in self.timer.seconds:
+            phases['dedupe'] = max(0.0, self.timer.seconds['dedupe'] - scan - classify)
+        phases['move'] = max(0.0, wall - sum(phases.values()))
+        phases['total'] = wall
+        return phases
+
+    def json(self):
+        phases = self.phases
+        total = phases['total'] or 1e-9
+        return {
+            'mode': self.mode,
+            'started': self.started,
+            'cancelled': self.cancelled,
+            'phases': {phase: round(seconds, 4) for phase, seconds in phases.items()},
+            'moved': self.moved,
+            'moved_bytes': self.moved_bytes,
+            'unmatched': self.unmatched,
+            'duplicates': self.duplicates,
+            'duplicate_bytes': self.duplicate_bytes,
+            'collisions': self.collisions,
+            'files_per_second': round(self.moved / total, 1),
+            'bytes_per_second': round(self.moved_bytes / total),
+            'targets': self.targets,
+            'filters': self.filters,
+            'slowest': [
+                {'source': source, 'destination': destination, 'seconds': round(seconds, 4), 'size': size}
+                for seconds, _, source, destination, size in sorted(self._slowest, reverse=True)
+            ],
+            'skipped': self.skipped,
+            'skipped_samples': self.skipped_samples
+        }
+
+    def summary(self):
+        text = f'Cancelled. Moved {self.moved} files.' if self.cancelled else f'Done! Moved {self.moved} files.'
+        if self.duplicates:
+            text += f' Found {self.duplicates} duplicates ({self.duplicate_bytes / 1024 / 1024:.0f} MB).'
+        if self.collisions:
+            counts = ', '.join(f'{count} {collision}' for collision, count in self.collisions.items())
+            text += f' Names taken: {counts}.'
+        if self.skipped:
+            reasons = ', '.join(f'{count} {reason}' for reason, count in self.skipped.items())
+            text += f' Skipped {self.skipped_count} ({reasons}).'
+        return text
+
+    def write(self, folder: Path):
+        # One JSON object per line, appended after each run
+        with open(folder / REPORT_FILE, 'a', encoding='utf-8') as f:
+            f.write(dumps(self.json(), ensure_ascii=False) + '\n')
+
+def read_reports(folder: Path, limit: int = 200) -> list[dict]:
+    try:
+        with open(folder / REPORT_FILE, 'r', encoding='utf-8') as f:
+            lines = deque(f, maxlen=limit)
+    except OSError:
+        return []
+    reports = []
+    for line in lines:
+        try:
+            reports.append(loads(line))
+        except ValueError:
+            # A run killed while writing leaves a partial last line
+            continue
+    return reports
@@ -0,0 +1,85 @@
+import os
+from hashlib import sha1
+from json import dumps, loads
+from pathlib import Path
+from config import Filter, Target
+
+INDEX_VERSION = 1
+
+def filters_hash(filters: list[Filter]):
+    return sha1(dumps([filter.json() for filter in filters], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class TargetIndex:
+    def __init__(self, mtime_ns: int = None, entries: dict[str, list] = None):
+        # Directory mtime seen before the last scan, None when the directory has to be listed
+        self.mtime_ns = mtime_ns
+        # name -> [size, mtime_ns, filter index or -1, pending], only entries left in place
+        self.entries = entries or {}
+        self.next_entries: dict[str, list] = {}
+        self.next_mtime_ns: int = None
+
+    def is_unchanged(self, mtime_ns: int):
+        # Entries waiting for a retry (in use, still being written) force a new listing
+        return mtime_ns == self.mtime_ns and not any(entry[3] for entry in self.entries.values())
+
+    def start(self, mtime_ns: int):
+        self.next_mtime_ns = mtime_ns
+        self.next_entries = {}
+
+    def is_known(self, entry: os.DirEntry):
+        known = self.entries.get(entry.name)
+        if known is None or known[3]:
+            return False
+        stat = entry.stat(follow_symlinks=False)
+        if known[0] != stat.st_size or known[1] != stat.st_mtime_ns:
+            return False
+        self.next_entries[entry.name] = known
+        return True
+
+    def record(self, name: str, stat, filter_index: int, pending: bool):
+        self.next_entries[name] = [stat.st_size, stat.st_mtime_ns, filter_index, pending]
+
+# One small JSON file per target next to fc.conf, remembering what was left in place by the last run
+class ScanIndex:
+    def __init__(self, folder: Path, filters: list[Filter]):
+        self.folder = folder
+        self.key = filters_hash(filters)
+        self._targets: dict[str, TargetIndex] = {}
+
+    def _file(self, target_path: str):
+        return self.folder / (sha1(target_path.encode('utf-8')).hexdigest()[:16] + '.json')
+
+    def get(self, target: Target) -> TargetIndex:
+        target_index = self._targets.get(target.path)
+        if target_index is None:
+            target_index = self._targets[target.path] = self._load(target)
+        return target_index
+
+    def _load(self, target: Target):
+        try:
+            with open(self._file(target.path), 'r', encoding='utf-8') as f:
+                data = loads(f.read())
+        except (OSError, ValueError):
+            return TargetIndex()
+        # Changing the filters changes every classification, start from scratch
+        if data.get('version') != INDEX_VERSION or data.get('filters') != self.key or data.get('path') != target.path:
+            return TargetIndex()
+        return TargetIndex(data['mtime_ns'], data['entries'])
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        for path, target_index in self._targets.items():
+            if target_index.next_mtime_ns is None:
+                continue
+            data = {
+                'version': INDEX_VERSION,
+                'path': path,
+                'filters': self.key,
+                'mtime_ns': target_index.next_mtime_ns,
+                'entries': target_index.next_entries
+            }
+            file = self._file(path)
+            temp = file.with_name(file.name + '.tmp')
+            with open(temp, 'w', encoding='utf-8') as f:
+                f.write(dumps(data, ensure_ascii=False))
+            os.replace(temp, file)
@@ -0,0 +1,110 @@
+from collections import deque
+from copy import copy
+from datetime import datetime
+from threading import Event, Thread
+from config import Config
+from cron import parse_schedule
+from throttle import Throttle
+
+MB = 1024 * 1024
+# Longest sleep between two looks at the clock, a system clock set forward is noticed after this
+CHECK_INTERVAL = 30.0
+# How often a running cleaning is checked for its end
+RUNNING_CHECK_INTERVAL = 1.0
+
+class ScheduledTarget:
+    def __init__(self, target, schedule, now: datetime):
+        self.target = target
+        self.schedule = schedule
+        self.next_run = schedule.first_run(now)
+        # Runs not started because the previous one was still going
+        self.skipped = 0
+
+    def advance(self, now: datetime):
+        # Runs missed while the machine was asleep are not made up, the next one is in the future
+        next_run = self.schedule.next_run(self.next_run)
+        if next_run <= now:
+            next_run = self.schedule.next_run(now)
+        self.next_run = next_run
+
+# Cleans each target that has a schedule when it is due, one target at a time, on a
+# thread of its own so it can run at a low priority. A target due again while its
+# last cleaning is still running or waiting for its turn is skipped this time.
+class TargetScheduler:
+    def __init__(self, config: Config):
+        self.config = config
+
+    def scheduled_targets(self, now: datetime) -> list[ScheduledTarget]:
+        scheduled = []
+        for target in self.config.targets:
+            if not target.schedule:
+                continue
+            try:
+                scheduled.append(ScheduledTarget(target, parse_schedule(target.schedule), now))
+            except ValueError:
+                # A cron expression that never runs, e.g. on the 31st of February
+                continue
+        return scheduled
+
+    def run(self, progress, stop: Event, on_report=None):
+        scheduled = self.scheduled_targets(datetime.now())
+        if not scheduled:
+            raise ValueError('No target has a schedule.')
+
+        waiting: deque[ScheduledTarget] = deque()
+        running: ScheduledTarget = None
+        thread: Thread = None
+        label = None
+        try:
+            while not stop.is_set():
+                now = datetime.now()
+                for job in scheduled:
+                    if job.next_run > now:
+                        continue
+                    if job is running or job in waiting:
+                        job.skipped += 1
+                        progress.setLabelText(f'Skipped {job.target.name}, its last cleaning is still running.')
+                        label = None
+                    else:
+                        waiting.append(job)
+                    job.advance(now)
+
+                if thread is not None and not thread.is_alive():
+                    thread = running = None
+                if thread is None and waiting:
+                    running = waiting.popleft()
+                    thread = Thread(target=self._clean, args=(running, progress, stop, on_report), name=f'scheduled-{running.target.name}', daemon=True)
+                    thread.start()
+                    label = None
+                if thread is None:
+                    upcoming = min(scheduled, key=lambda job: job.next_run)
+                    text = f'Next cleaning: {upcoming.target.name} at {upcoming.next_run:%Y-%m-%d %H:%M}.'
+                    if text != label:
+                        progress.setLabelText(text)
+                        label = text
+
+                delay = (min(job.next_run for job in scheduled) - datetime.now()).total_seconds()
+                stop.wait(max(0.05, min(delay, RUNNING_CHECK_INTERVAL if thread is not None else CHECK_INTERVAL)))
+        finally:
+            # stop is also the cancel event of the cleaning, it ends after the moves already started
+            if thread is not None:
+                thread.join()
+
+    def _clean(self, job: ScheduledTarget, progress, stop: Event, on_report):
+        from helper import clean_folders
+        target = job.target
+        throttle = Throttle(
+            target.max_files_per_second, target.max_mb_per_second * MB if target.max_mb_per_second else None,
+            target.low_priority, stop
+        )
+        # The scan and the classification run on this thread, the moves on threads it starts
+        throttle.start_thread()
+        run_config = copy(self.config)
+        run_config.targets = [target]
+        try:
+            report = clean_folders(run_config, progress, cancel=stop, throttle=throttle, mode='scheduled')
+        except Exception as e:
+            progress.setLabelText(f'Error cleaning {target.name}: {e}')
+            return
+        if on_report:
+            on_report(report)
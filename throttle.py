@@ -0,0 +1,65 @@
+import ctypes, os, platform, sys, threading
+from threading import Event
+from time import monotonic
+
+# Unused rate carried over from quiet moments, so a run can start with a short burst
+BURST_SECONDS = 1.0
+
+# ioprio_set, missing from the os module
+IOPRIO_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314, 'armv6l': 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+# SetThreadPriority mode lowering both the CPU and the I/O priority of the calling thread
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+def lower_thread_priority():
+    # For the calling thread only, the other threads of the app keep their priority.
+    # Best effort: nothing happens where the platform offers no per-thread priority.
+    if sys.platform.startswith('linux'):
+        thread_id = threading.get_native_id()
+        try:
+            # Linux nice values are per thread, this is `nice -n 19` for this one
+            os.setpriority(os.PRIO_PROCESS, thread_id, 19)
+        except OSError:
+            pass
+        syscall = IOPRIO_SYSCALLS.get(platform.machine())
+        if syscall is not None:
+            # `ionice -c 3`: only gets the disk when nobody else wants it
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.syscall(syscall, IOPRIO_WHO_PROCESS, thread_id, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+    elif sys.platform == 'win32':
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN)
+
+# Limits how fast the moves of a run are started, in files and bytes per second.
+# Only the thread submitting the moves calls wait(), the mover threads call start_thread().
+class Throttle:
+    def __init__(self, files_per_second: float = None, bytes_per_second: float = None, low_priority: bool = False, cancel: Event = None):
+        self.files_per_second = files_per_second
+        self.bytes_per_second = bytes_per_second
+        self.low_priority = low_priority
+        self.cancel = cancel or Event()
+        # Time at which the moves let through so far are paid for, per limit
+        self._files_until = self._bytes_until = monotonic()
+
+    @property
+    def limits_bytes(self):
+        return bool(self.bytes_per_second)
+
+    def wait(self, size: int = 0):
+        # Blocks until one more file of this size fits in the limits, or the run is cancelled
+        now = monotonic()
+        delay = 0.0
+        if self.files_per_second:
+            self._files_until = max(self._files_until, now - BURST_SECONDS) + 1 / self.files_per_second
+            delay = self._files_until - now
+        if self.bytes_per_second:
+            self._bytes_until = max(self._bytes_until, now - BURST_SECONDS) + size / self.bytes_per_second
+            delay = max(delay, self._bytes_until - now)
+        if delay > 0:
+            self.cancel.wait(delay)
+
+    def start_thread(self):
+        if self.low_priority:
+            lower_thread_priority()
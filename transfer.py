@@ -0,0 +1,165 @@
+import ctypes, errno, os, shutil, sys
+from pathlib import Path
+from typing import Callable
+
+CHUNK_SIZE = 8 * 1024 * 1024
+PARTIAL_SUFFIX = '.fcpart'
+
+# renameat2 and renamex_np flags failing the rename when the destination exists
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+RENAME_EXCL = 4
+
+def _libc_rename():
+    # Renames that refuse to replace the destination, in the same syscall as the rename itself
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except (OSError, TypeError):
+        return None
+    if sys.platform.startswith('linux') and hasattr(libc, 'renameat2'):
+        renameat2 = libc.renameat2
+        return lambda source, destination: renameat2(AT_FDCWD, source, AT_FDCWD, destination, RENAME_NOREPLACE)
+    if sys.platform == 'darwin' and hasattr(libc, 'renamex_np'):
+        renamex_np = libc.renamex_np
+        return lambda source, destination: renamex_np(source, destination, RENAME_EXCL)
+    return None
+
+_RENAME = None if sys.platform == 'win32' else _libc_rename()
+
+def rename_no_replace(source: Path, destination: Path):
+    # Raises FileExistsError instead of replacing the destination
+    if sys.platform == 'win32':
+        # Windows never replaces on a rename
+        os.rename(source, destination)
+        return
+    if _RENAME is not None:
+        if _RENAME(os.fsencode(source), os.fsencode(destination)) == 0:
+            return
+        error = ctypes.get_errno()
+        if error not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP):
+            raise OSError(error, os.strerror(error), str(source), None, str(destination))
+        # The filesystem does not support it, e.g. some network shares
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(destination))
+    os.rename(source, destination)
+
+def _copy_file_range(src_fd, dst_fd, size, on_progress):
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - copied))
+        if sent == 0:
+            break
+        copied += sent
+        on_progress(copied)
+    return copied
+
+def _sendfile(src_fd, dst_fd, size, on_progress):
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst_fd, src_fd, copied, min(CHUNK_SIZE, size - copied))
+        if sent == 0:
+            break
+        copied += sent
+        on_progress(copied)
+    return copied
+
+def _chunked(src_fd, dst_fd, size, on_progress):
+    copied = 0
+    buffer = bytearray(min(CHUNK_SIZE, max(size, 1)))
+    view = memoryview(buffer)
+    with os.fdopen(src_fd, 'rb', buffering=0, closefd=False) as src, os.fdopen(dst_fd, 'wb', buffering=0, closefd=False) as dst:
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                break
+            dst.write(view[:read])
+            copied += read
+            on_progress(copied)
+    return copied
+
+def _copy_methods():
+    # Kernel side copies first, each one may refuse a given pair of filesystems
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(_copy_file_range)
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        # Only Linux accepts a regular file as the sendfile destination
+        methods.append(_sendfile)
+    methods.append(_chunked)
+    return methods
+
+COPY_METHODS = _copy_methods()
+
+def copy_partial(source: Path, destination: Path, on_progress: Callable[[int, int], None] = None) -> tuple[str, int]:
+    # Copies into a partial file next to the destination, synced once its size checks out,
+    # and returns its path and size. The destination name is left alone.
+    partial = str(destination) + PARTIAL_SUFFIX
+    with open(source, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        report = (lambda done: on_progress(done, size)) if on_progress else (lambda done: None)
+        # Moves into a folder run one at a time, a partial file already there was left by a
+        # copy that was killed and is written over, it is no reason to skip the move
+        with open(partial, 'wb') as dst:
+            try:
+                copied = None
+                for method in COPY_METHODS:
+                    try:
+                        copied = method(src.fileno(), dst.fileno(), size, report)
+                        break
+                    except OSError:
+                        if method is _chunked:
+                            raise
+                        # The kernel copy is not supported here, start over with the next method
+                        src.seek(0)
+                        dst.seek(0)
+                        dst.truncate()
+                written = os.fstat(dst.fileno()).st_size
+                if copied != size or written != size:
+                    raise OSError(f'Copied {written} of {size} bytes to {destination}')
+                os.fsync(dst.fileno())
+            except BaseException:
+                dst.close()
+                os.unlink(partial)
+                raise
+    shutil.copystat(source, partial)
+    return partial, size
+
+def copy_file(source: Path, destination: Path, on_progress: Callable[[int, int], None] = None, replace: bool = False):
+    # The partial copy is renamed to the destination once complete, so the destination name only
+    # ever shows a complete file. An existing destination is only replaced when asked, otherwise
+    # the copy is dropped with a FileExistsError.
+    partial, size = copy_partial(source, destination, on_progress)
+    try:
+        if replace:
+            os.replace(partial, destination)
+        else:
+            rename_no_replace(partial, destination)
+    except BaseException:
+        os.unlink(partial)
+        raise
+    return size
+
+def move_file_across_devices(source: Path, destination: Path, on_progress: Callable[[int, int], None] = None, replace: bool = False):
+    if replace:
+        # The file being replaced stays until the source is gone, a source still in use
+        # leaves both files as they were
+        partial, _ = copy_partial(source, destination, on_progress)
+        try:
+            os.unlink(source)
+        except PermissionError:
+            os.unlink(partial)
+            return 'in use'
+        except BaseException:
+            os.unlink(partial)
+            raise
+        # The partial file is the only copy from here, it is never removed
+        os.replace(partial, destination)
+        return None
+    copy_file(source, destination, on_progress)
+    try:
+        os.unlink(source)
+    except PermissionError:
+        # The source is still in use, keep it and drop the copy
+        os.unlink(destination)
+        return 'in use'
+    return None
@@ -10,15 +10,20 @@ from PyQt6.QtWidgets import (
     QTabWidget, QListWidget,
     QVBoxLayout, QAbstractItemView,
     QComboBox, QProgressBar, QSpacerItem,
-    QSizePolicy
+    QSizePolicy, QFileDialog, QHBoxLayout,
+    QPlainTextEdit, QMessageBox
 )
-from PyQt6.QtCore import Qt, QEventLoop
+from PyQt6.QtCore import Qt, QEventLoop, QThread
 from PyQt6.QtGui import QIcon
 from widgets import (
-    CleaningProgressBar,
-    CustomFilterItem, FilterEditorDialog, 
-    CustomTargetItem, TargetEditorDialog
+    CleaningProgressBar, ConfigSaver, PlanDialog,
+    ListModel, SearchableList,
+    FilterEditorDialog, TargetEditorDialog
 )
+from worker import CleaningWorker, WatchWorker, ScheduleWorker
+from plan import MovePlan
+from report import read_reports
+from journal import resumable_run, undoable_run
 from qt_material import apply_stylesheet, list_themes
 
 QComboBox_dark_stylesheet = """ QComboBox { color: white; padding: 5px; } """
@@ -36,6 +41,9 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("Folder Cleaner")
         self.app = app
         self.config = config
+        self.saver = ConfigSaver(config, self)
+        # Edits still waiting for their save are written before the app exits
+        app.aboutToQuit.connect(self.saver.flush)
 
         self._setupMenuBars()
 
@@ -51,15 +59,23 @@ class MainWindow(QMainWindow):
         self.home_tab = MainWindowTab(self, config)
         self.tab.addTab(self.home_tab, "Home")
 
-        self.filters_tab = FiltersTab(config)
+        self.filters_tab = FiltersTab(config, self.saver)
         self.tab.addTab(self.filters_tab, "Filters")
 
-        self.targets_tab = TargetsTab(config)
+        self.targets_tab = TargetsTab(config, self.saver)
         self.tab.addTab(self.targets_tab, "Targets")
 
         self.theme_tab = ThemeTab(self, config)
         self.tab.addTab(self.theme_tab, "Theme")
 
+        self.reports_tab = ReportsTab(config)
+        self.tab.addTab(self.reports_tab, "Reports")
+        self.tab.currentChanged.connect(self._tab_changed)
+
+    def _tab_changed(self, index: int):
+        if self.tab.widget(index) is self.reports_tab:
+            self.reports_tab.refresh()
+
     def _get_icon_path(self):
         if getattr(sys, 'frozen', False):
             # If the application is run as a bundle (e.g., with PyInstaller)
@@ -72,13 +88,17 @@ class MainWindow(QMainWindow):
         menu_bar = self.menuBar()
 
         save_action = menu_bar.addAction("Save")
-        save_action.triggered.connect(self.config.save)
+        save_action.triggered.connect(self.saver.flush)
 
         load_action = menu_bar.addAction("Load")
         load_action.triggered.connect(self._load_config)
 
     def _load_config(self):
-        self.config.load()
+        try:
+            self.config.load()
+        except ValueError as e:
+            QMessageBox.warning(self, "Load", str(e))
+            return
         theme = self.config.theme if self.config.theme and self.config.theme in list_themes() else 'dark_blue.xml'
         self.config.theme = theme
         self.config.save()
@@ -102,45 +122,236 @@ class MainWindowTab(QWidget):
 
         layout.addSpacerItem(QSpacerItem(20, 40, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Expanding))
 
-        clean_button = QPushButton("Clean Folders", self)
-        layout.addWidget(clean_button, alignment=Qt.AlignmentFlag.AlignHCenter)
-        clean_button.clicked.connect(self._clean_folders)
+        self.clean_button = QPushButton("Clean Folders", self)
+        layout.addWidget(self.clean_button, alignment=Qt.AlignmentFlag.AlignHCenter)
+        self.clean_button.clicked.connect(self._clean_folders)
+
+        self.watch_button = QPushButton("Watch Folders", self)
+        self.watch_button.setCheckable(True)
+        layout.addWidget(self.watch_button, alignment=Qt.AlignmentFlag.AlignHCenter)
+        self.watch_button.toggled.connect(self._watch_folders)
+
+        self.schedule_button = QPushButton("Run Schedule", self)
+        self.schedule_button.setCheckable(True)
+        layout.addWidget(self.schedule_button, alignment=Qt.AlignmentFlag.AlignHCenter)
+        self.schedule_button.toggled.connect(self._run_schedule)
+
+        plan_layout = QHBoxLayout()
+        self.preview_button = QPushButton("Preview Plan", self)
+        self.preview_button.clicked.connect(self._preview_plan)
+        plan_layout.addWidget(self.preview_button)
+
+        self.run_plan_button = QPushButton("Run Plan File...", self)
+        self.run_plan_button.clicked.connect(self._run_plan_file)
+        plan_layout.addWidget(self.run_plan_button)
+        layout.addLayout(plan_layout)
+
+        run_layout = QHBoxLayout()
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self._cancel)
+        run_layout.addWidget(self.cancel_button)
+
+        self.resume_button = QPushButton("Resume Last Run", self)
+        self.resume_button.clicked.connect(self._resume)
+        run_layout.addWidget(self.resume_button)
+
+        self.undo_button = QPushButton("Undo Last Run", self)
+        self.undo_button.clicked.connect(self._undo)
+        run_layout.addWidget(self.undo_button)
+        layout.addLayout(run_layout)
 
         layout.addSpacerItem(QSpacerItem(20, 40, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Expanding))
 
         self.progress_bar = CleaningProgressBar(self)
         layout.addWidget(self.progress_bar, alignment=Qt.AlignmentFlag.AlignBottom)
 
+        self._thread: QThread = None
+        self._worker: CleaningWorker = None
+        self._update_resume()
+
     def _toggle_all(self, enabled: bool):
-        for i in range(0,self.mainWindow.tab.count()):
-            self.mainWindow.tab.setTabVisible(i, enabled)
-        for i in range(len(self.mainWindow.menuBar().actions())):
-            self.mainWindow.menuBar().actions()[i].setVisible(enabled)
+        # The other tabs and the menu edit the config a run is using, they are greyed out
+        # meanwhile. Home stays usable, it holds the progress and the Cancel button.
+        tab = self.mainWindow.tab
+        if not enabled:
+            tab.setCurrentWidget(self)
+        for i in range(tab.count()):
+            if tab.widget(i) is not self:
+                tab.setTabEnabled(i, enabled)
+        for action in self.mainWindow.menuBar().actions():
+            action.setEnabled(enabled)
 
     def _clean_folders(self):
-        from helper import clean_folders
+        if self._thread is not None:
+            return
 
         self.progress_bar.setLabelText("Cleaning Progress")
-        
+        self._start_worker(CleaningWorker(self.config))
+
+    def _preview_plan(self):
+        if self._thread is not None:
+            return
+
+        from helper import plan_folders
+        self._start_worker(CleaningWorker(self.config, task=plan_folders))
+
+    def _run_plan_file(self):
+        if self._thread is not None:
+            return
+
+        file, _ = QFileDialog.getOpenFileName(self, "Run Plan", "", "Plan (*.json)")
+        if not file:
+            return
+        try:
+            plan = MovePlan.load(Path(file))
+        except (OSError, ValueError, KeyError) as e:
+            self.progress_bar.setLabelText(f'Error: cannot read {file}: {e}')
+            return
+        self._show_plan(plan)
+
+    def _show_plan(self, plan: MovePlan):
+        dialog = PlanDialog(plan, self)
+        if dialog.exec():
+            from helper import execute_plan
+            self._start_worker(CleaningWorker(self.config, task=lambda config, progress, cancel: execute_plan(config, plan, progress, cancel=cancel)))
+
+    def _cancel(self):
+        if self._worker is not None and not isinstance(self._worker, WatchWorker):
+            self.progress_bar.setLabelText("Cancelling...")
+            self.cancel_button.setEnabled(False)
+            self._worker.stop()
+
+    def _resume(self):
+        if self._thread is not None:
+            return
+
+        from helper import resume_run
+        self._start_worker(CleaningWorker(self.config, task=resume_run))
+
+    def _undo(self):
+        if self._thread is not None:
+            return
+
+        run = undoable_run(self.config.exe_path)
+        if run is None:
+            self._update_resume()
+            return
+        answer = QMessageBox.question(
+            self, "Undo Last Run", f"Move the {len(run.moved)} files of the {run.mode} run from {run.started} back?"
+        )
+        if answer != QMessageBox.StandardButton.Yes:
+            return
+        from helper import undo_last_run
+        self._start_worker(CleaningWorker(self.config, task=undo_last_run))
+
+    def _update_resume(self):
+        # Resume is enabled when the last run was interrupted with moves left to make
+        self.resume_button.setEnabled(resumable_run(self.config.exe_path) is not None)
+        self.undo_button.setEnabled(undoable_run(self.config.exe_path) is not None)
+
+    def _watch_folders(self, checked: bool):
+        if not checked:
+            if isinstance(self._worker, WatchWorker):
+                self.progress_bar.setLabelText("Stopping...")
+                self._worker.stop()
+            return
+        if self._thread is not None:
+            return
+
+        self.progress_bar.setMaximum(0)
+        self._start_worker(WatchWorker(self.config))
+
+    def _run_schedule(self, checked: bool):
+        # Cleans the targets with a schedule when they are due, until unchecked
+        if not checked:
+            if isinstance(self._worker, ScheduleWorker):
+                self.progress_bar.setLabelText("Stopping...")
+                self._worker.stop()
+            return
+        if self._thread is not None:
+            return
+
+        self._start_worker(ScheduleWorker(self.config))
+
+    def _start_worker(self, worker: CleaningWorker):
         self._toggle_all(False)
-        
-        clean_folders(self.config, self)
+        self.clean_button.setEnabled(False)
+        self.preview_button.setEnabled(False)
+        self.run_plan_button.setEnabled(False)
+        self.resume_button.setEnabled(False)
+        self.undo_button.setEnabled(False)
+        self.watch_button.setEnabled(type(worker) is WatchWorker)
+        self.schedule_button.setEnabled(isinstance(worker, ScheduleWorker))
+        self.cancel_button.setEnabled(not isinstance(worker, WatchWorker))
+
+        # The cleaning runs on its own thread, progress comes back through queued signals
+        self._thread = QThread(self)
+        self._worker = worker
+        self._worker.moveToThread(self._thread)
+
+        self._worker.labelChanged.connect(self.progress_bar.setLabelText)
+        self._worker.maximumChanged.connect(self.progress_bar.setMaximum)
+        self._worker.progressChanged.connect(self.progress_bar.setProgress)
+        self._worker.finished.connect(self._on_clean_finished)
+        self._worker.failed.connect(self._on_clean_failed)
+
+        self._thread.started.connect(self._worker.run)
+        self._thread.finished.connect(self._worker.deleteLater)
+        self._thread.finished.connect(self._thread.deleteLater)
+        self._thread.start()
+
+    def _on_clean_finished(self, result):
+        if isinstance(self._worker, ScheduleWorker):
+            self.progress_bar.setLabelText(f'Stopped the schedule. Moved {result} files.')
+            self.progress_bar.setMaximum(100)
+            self.progress_bar.setValue(100)
+        elif isinstance(self._worker, WatchWorker):
+            self.progress_bar.setLabelText(f'Stopped watching. Moved {result} files.')
+            self.progress_bar.setMaximum(100)
+            self.progress_bar.setValue(100)
+        cancelled = self._worker.stopped
+        self._stop_worker()
+        # A cancelled preview only has part of the plan
+        if isinstance(result, MovePlan) and not cancelled:
+            self._show_plan(result)
+
+    def _on_clean_failed(self, message: str):
+        self.progress_bar.setLabelText(f'Error: {message}')
+        self._stop_worker()
+
+    def _stop_worker(self):
+        self._thread.quit()
+        self._thread.wait()
+        self._thread = None
+        self._worker = None
+        self.clean_button.setEnabled(True)
+        self.preview_button.setEnabled(True)
+        self.run_plan_button.setEnabled(True)
+        self.watch_button.setEnabled(True)
+        self.schedule_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self._update_resume()
+        for button in (self.watch_button, self.schedule_button):
+            button.blockSignals(True)
+            button.setChecked(False)
+            button.blockSignals(False)
+        self._toggle_all(True)
 
 class FiltersTab(QWidget):
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, saver: ConfigSaver):
         super().__init__()
         self.config = config
+        self.saver = saver
 
         main_layout = QGridLayout(self)
         self.setLayout(main_layout)
 
-        self.filter_list = QListWidget(self)
+        # The model edits config.filters in place, row by row
+        self.model = ListModel(self.config.filters, lambda filter: filter.name, self)
+        self.filter_list = SearchableList(self.model, "Search Filters", self)
         self.filter_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
-        self.filter_list.itemDoubleClicked.connect(self.edit_filter)
-
-        for filter in self.config.filters:
-            item = CustomFilterItem(filter)
-            self.filter_list.addItem(item)
+        self.filter_list.rowActivated.connect(self.edit_filter)
 
         main_layout.addWidget(self.filter_list, 0, 0, 1, 1)
 
@@ -164,73 +375,54 @@ class FiltersTab(QWidget):
     def add_filter(self):
         dialog = FilterEditorDialog(config=self.config, parent=self)
         if dialog.exec():
-            new_filter = dialog.filter
-            self.config.filters.append(new_filter)
-            self._update_filters()
-            self.config.save()
-
-    def edit_filter(self, item):
-        filter = item.filter
-        dialog = FilterEditorDialog(config=self.config, filter=filter, parent=self)
+            self.model.append(dialog.filter)
+            self.saver.schedule()
+
+    def edit_filter(self, row: int):
+        dialog = FilterEditorDialog(config=self.config, filter=self.config.filters[row], parent=self)
         if dialog.exec():
-            updated_filter = dialog.filter
-            index = self.config.filters.index(filter)
-            self.config.filters[index] = updated_filter
-            self._update_filters()
-            self.config.save()
+            self.model.replace(row, dialog.filter)
+            self.saver.schedule()
 
     def move_up(self):
-        current_row = self.filter_list.currentRow()
-        if current_row > 0:
-            current_item = self.filter_list.takeItem(current_row)
-            self.filter_list.insertItem(current_row - 1, current_item)
-            self.filter_list.setCurrentRow(current_row - 1)
-            self._save_filters()
+        self._move(-1)
 
     def move_down(self):
-        current_row = self.filter_list.currentRow()
-        if current_row < self.filter_list.count() - 1:
-            current_item = self.filter_list.takeItem(current_row)
-            self.filter_list.insertItem(current_row + 1, current_item)
-            self.filter_list.setCurrentRow(current_row + 1)
-            self._save_filters()
+        self._move(1)
+
+    def _move(self, offset: int):
+        current_row = self.filter_list.current_row()
+        if current_row >= 0 and self.model.move(current_row, current_row + offset):
+            self.filter_list.set_current_row(current_row + offset)
+            self.saver.schedule()
 
     def _update_filters(self):
-        self.filter_list.clear()
-        for filter in self.config.filters:
-            item = CustomFilterItem(filter)
-            self.filter_list.addItem(item)
+        self.model.set_items(self.config.filters)
 
-    def _save_filters(self):
-        self.config.filters = [self.filter_list.item(i).filter for i in range(self.filter_list.count())]
-        self.config.save()
-    
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Delete:
-            selected_items = self.filter_list.selectedItems()
-            if not selected_items:
+            selected_rows = self.filter_list.selected_rows()
+            if not selected_rows:
                 return
-            for item in selected_items:
-                self.filter_list.takeItem(self.filter_list.row(item))
-            self._save_filters()
+            self.model.remove(selected_rows)
+            self.saver.schedule()
         else:
             super().keyPressEvent(event)
 
 class TargetsTab(QWidget):
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, saver: ConfigSaver):
         super().__init__()
         self.config = config
+        self.saver = saver
 
         main_layout = QGridLayout(self)
         self.setLayout(main_layout)
 
-        self.target_list = QListWidget(self)
+        # The model edits config.targets in place, row by row
+        self.model = ListModel(self.config.targets, lambda target: target.name + " - " + target.path, self)
+        self.target_list = SearchableList(self.model, "Search Targets", self)
         self.target_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
-        self.target_list.itemDoubleClicked.connect(self.edit_target)
-
-        for target in self.config.targets:
-            item = CustomTargetItem(target)
-            self.target_list.addItem(item)
+        self.target_list.rowActivated.connect(self.edit_target)
 
         main_layout.addWidget(self.target_list, 0, 0, 1, 1)
 
@@ -254,55 +446,37 @@ class TargetsTab(QWidget):
     def add_target(self):
         dialog = TargetEditorDialog(config=self.config, parent=self)
         if dialog.exec():
-            new_target = dialog.target
-            self.config.targets.append(new_target)
-            self._update_targets()
-            self.config.save()
-
-    def edit_target(self, item):
-        target = item.target
-        dialog = TargetEditorDialog(config=self.config, target=target, parent=self)
+            self.model.append(dialog.target)
+            self.saver.schedule()
+
+    def edit_target(self, row: int):
+        dialog = TargetEditorDialog(config=self.config, target=self.config.targets[row], parent=self)
         if dialog.exec():
-            updated_target = dialog.target
-            index = self.config.targets.index(target)
-            self.config.targets[index] = updated_target
-            self._update_targets()
-            self.config.save()
+            self.model.replace(row, dialog.target)
+            self.saver.schedule()
 
     def move_up(self):
-        current_row = self.target_list.currentRow()
-        if current_row > 0:
-            current_item = self.target_list.takeItem(current_row)
-            self.target_list.insertItem(current_row - 1, current_item)
-            self.target_list.setCurrentRow(current_row - 1)
-            self._save_targets()
+        self._move(-1)
 
     def move_down(self):
-        current_row = self.target_list.currentRow()
-        if current_row < self.target_list.count() - 1:
-            current_item = self.target_list.takeItem(current_row)
-            self.target_list.insertItem(current_row + 1, current_item)
-            self.target_list.setCurrentRow(current_row + 1)
-            self._save_targets()
+        self._move(1)
 
-    def _update_targets(self):
-        self.target_list.clear()
-        for target in self.config.targets:
-            item = CustomTargetItem(target)
-            self.target_list.addItem(item)
+    def _move(self, offset: int):
+        current_row = self.target_list.current_row()
+        if current_row >= 0 and self.model.move(current_row, current_row + offset):
+            self.target_list.set_current_row(current_row + offset)
+            self.saver.schedule()
 
-    def _save_targets(self):
-        self.config.targets = [self.target_list.item(i).target for i in range(self.target_list.count())]
-        self.config.save()
+    def _update_targets(self):
+        self.model.set_items(self.config.targets)
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Delete:
-            selected_items = self.target_list.selectedItems()
-            if not selected_items:
+            selected_rows = self.target_list.selected_rows()
+            if not selected_rows:
                 return
-            for item in selected_items:
-                self.target_list.takeItem(self.target_list.row(item))
-            self._save_targets()
+            self.model.remove(selected_rows)
+            self.saver.schedule()
         else:
             super().keyPressEvent(event)
 
@@ -332,10 +506,79 @@ class ThemeTab(QWidget):
     def apply_theme(self):
         theme = self.theme_dropdown.currentText()
         self.config.theme = theme
-        self.config.save()
+        self.mainWindow.saver.schedule()
         print(f"Applying theme: {theme}")
         apply_stylesheet(self.mainWindow.app, theme=theme)
         self.theme_dropdown.setStyleSheet(self._QComboBox_stylesheet())
 
     def _QComboBox_stylesheet(self):
-        return QComboBox_dark_stylesheet if "dark" in self.config.theme else QComboBox_light_stylesheet
\ No newline at end of file
+        return QComboBox_dark_stylesheet if "dark" in self.config.theme else QComboBox_light_stylesheet
+
+class ReportsTab(QWidget):
+    def __init__(self, config: Config):
+        super().__init__()
+        self.config = config
+        self.reports: list[dict] = []
+
+        main_layout = QGridLayout(self)
+        self.setLayout(main_layout)
+
+        self.report_list = QListWidget(self)
+        self.report_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.report_list.currentRowChanged.connect(self.show_report)
+        main_layout.addWidget(self.report_list, 0, 0)
+
+        self.details = QPlainTextEdit(self)
+        self.details.setReadOnly(True)
+        main_layout.addWidget(self.details, 0, 1)
+        main_layout.setColumnStretch(1, 2)
+
+        refresh_button = QPushButton("Refresh", self)
+        refresh_button.clicked.connect(self.refresh)
+        main_layout.addWidget(refresh_button, 1, 0)
+
+    def refresh(self):
+        # Newest run first
+        self.reports = list(reversed(read_reports(self.config.exe_path)))
+        self.report_list.clear()
+        for report in self.reports:
+            self.report_list.addItem(f"{report['started']} {report['mode']}: {report['moved']} moved")
+        if self.reports:
+            self.report_list.setCurrentRow(0)
+        else:
+            self.details.setPlainText("No runs yet.")
+
+    def show_report(self, row: int):
+        if row < 0 or row >= len(self.reports):
+            return
+        report = self.reports[row]
+        phases = report['phases']
+        # Reports written before a phase or a count existed lack its key
+        timings = ', '.join(f"{phase} {phases[phase]:.2f}s" for phase in ('scan', 'classify', 'dedupe', 'move') if phase in phases)
+        lines = [
+            f"Started: {report['started']} ({report['mode']})",
+            f"Total: {phases['total']:.2f}s ({timings})",
+            f"Moved: {report['moved']} files, {report['moved_bytes'] / (1024 * 1024):.1f} MB",
+            f"Throughput: {report['files_per_second']:.0f} files/s, {report['bytes_per_second'] / (1024 * 1024):.1f} MB/s",
+            f"Unmatched: {report['unmatched']}"
+        ]
+        if report.get('duplicates'):
+            lines.append(f"Duplicates: {report['duplicates']} files, {report['duplicate_bytes'] / (1024 * 1024):.1f} MB")
+        if report.get('collisions'):
+            lines.append("Names taken: " + ", ".join(f"{count} {collision}" for collision, count in report['collisions'].items()))
+        lines += ["", "Targets:"]
+        for target, counts in report['targets'].items():
+            lines.append(f"  {target}: {counts['moved']} moved, {counts['skipped']} skipped, {counts['unmatched']} unmatched")
+        lines += ["", "Filters:"]
+        for filter, count in sorted(report['filters'].items(), key=lambda item: -item[1]):
+            lines.append(f"  {filter}: {count}")
+        lines += ["", "Slowest moves:"]
+        for move in report['slowest']:
+            lines.append(f"  {move['seconds']:.3f}s {move['source']} -> {move['destination']}")
+        if report['skipped']:
+            lines += ["", "Skipped:"]
+            for reason, count in report['skipped'].items():
+                lines.append(f"  {reason}: {count}")
+                for source in report['skipped_samples'].get(reason, [])[:10]:
+                    lines.append(f"    {source}")
+        self.details.setPlainText("\n".join(lines))
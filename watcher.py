@@ -0,0 +1,233 @@
+import ctypes, ctypes.util, os, select, struct, sys
+from stat import S_ISREG
+from threading import Event
+from time import monotonic, time
+from config import Config, Target
+from mover import DestinationIndex
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+# Skip reasons worth another try once the entry has had time to settle
+RETRY_REASONS = {'in use', 'recently modified'}
+
+# Change kinds reported by the backends
+WRITING = 'writing'
+WRITTEN = 'written'
+RESCAN = 'rescan'
+
+def written_on_create(path: str) -> bool:
+    # Only a new regular file gets written to after IN_CREATE, links, fifos and the
+    # like never see a close event
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        # Already gone, the move reports it
+        return True
+    return not S_ISREG(stat.st_mode) or stat.st_nlink > 1
+
+def newest_write(path: str) -> float:
+    # A folder's own mtime only changes with its direct entries, files written deeper
+    # down are found by walking it
+    try:
+        newest = os.lstat(path).st_mtime
+    except OSError:
+        return 0.0
+    folders = [path]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    try:
+                        newest = max(newest, entry.stat(follow_symlinks=False).st_mtime)
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return newest
+
+class InotifyBackend:
+    def __init__(self, paths: list[str]):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._paths: dict[int, str] = {}
+        for target_path in paths:
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(target_path), WATCH_MASK)
+            if wd >= 0:
+                self._paths[wd] = target_path
+
+    @staticmethod
+    def available():
+        return sys.platform.startswith('linux')
+
+    def wait(self, timeout: float) -> list[tuple[str, str, str]]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changes = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.extend((target_path, None, RESCAN) for target_path in self._paths.values())
+                continue
+            target_path = self._paths.get(wd)
+            if target_path is None or mask & IN_IGNORED or not name:
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or (mask & IN_CREATE and mask & IN_ISDIR):
+                changes.append((target_path, name, WRITTEN))
+            elif mask & IN_CREATE and written_on_create(os.path.join(target_path, name)):
+                changes.append((target_path, name, WRITTEN))
+            elif mask & (IN_CREATE | IN_MODIFY):
+                changes.append((target_path, name, WRITING))
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingBackend:
+    def __init__(self, paths: list[str], interval: float = 5.0):
+        self.paths = paths
+        self.interval = interval
+        self._next_poll = monotonic()
+        # target path -> name -> (size, mtime_ns) seen by the previous poll
+        self._snapshots: dict[str, dict[str, tuple[int, int]]] = {}
+
+    def wait(self, timeout: float) -> list[tuple[str, str, str]]:
+        delay = self._next_poll - monotonic()
+        if delay > timeout:
+            Event().wait(timeout)
+            return []
+        if delay > 0:
+            Event().wait(delay)
+        self._next_poll = monotonic() + self.interval
+
+        changes = []
+        for target_path in self.paths:
+            previous = self._snapshots.get(target_path, {})
+            current = {}
+            try:
+                with os.scandir(target_path) as entries:
+                    for entry in entries:
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                continue
+            for name, state in current.items():
+                if previous.get(name) != state:
+                    # Polling cannot see the file being closed, it is done once it stops changing
+                    changes.append((target_path, name, WRITTEN))
+            self._snapshots[target_path] = current
+        return changes
+
+    def close(self):
+        pass
+
+# Cleans targets continuously: changed entries are only classified and moved once
+# they have been quiet for `settle` seconds after their last write.
+class FolderWatcher:
+    def __init__(self, config: Config, settle: float = 2.0, poll_interval: float = 5.0, use_inotify: bool = True):
+        self.config = config
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+
+    def _backend(self, paths: list[str]):
+        if self.use_inotify and InotifyBackend.available():
+            try:
+                return InotifyBackend(paths)
+            except OSError:
+                pass
+        return PollingBackend(paths, self.poll_interval)
+
+    def run(self, progress, stop: Event, on_report=None):
+        from helper import clean_entries, content_classifier, sorted_folders
+
+        targets: dict[str, Target] = {target.path: target for target in self.config.targets if os.path.isdir(target.path)}
+        filters_folders = sorted_folders(self.config)
+        backend = self._backend(list(targets))
+        # Kept for the whole watch, its cache is only loaded and saved once
+        content = content_classifier(self.config)
+        # Destination folders are listed once for the whole watch, not once per burst of files
+        destinations = DestinationIndex()
+
+        # (target path, name) -> time the entry may be moved, None while it is still being written
+        pending: dict[tuple[str, str], float] = {}
+
+        def queue_all(target_path: str):
+            try:
+                names = os.listdir(target_path)
+            except OSError:
+                return
+            for name in names:
+                pending.setdefault((target_path, name), monotonic() + self.settle)
+
+        def retry(result):
+            if result.error in RETRY_REASONS:
+                pending[(result.item.target(self.config).path, result.item.file)] = monotonic() + self.settle * 5
+
+        # Whatever is already in the targets is handled like a burst of new files
+        for target_path in targets:
+            queue_all(target_path)
+
+        try:
+            while not stop.is_set():
+                deadlines = [ready_at for ready_at in pending.values() if ready_at is not None]
+                timeout = min(0.5, max(0.0, min(deadlines) - monotonic())) if deadlines else 0.5
+                for target_path, name, kind in backend.wait(timeout):
+                    if kind == RESCAN:
+                        queue_all(target_path)
+                    elif name in filters_folders:
+                        continue
+                    elif kind == WRITING:
+                        pending[(target_path, name)] = None
+                    else:
+                        # Bursts on the same entry only push its deadline back
+                        pending[(target_path, name)] = monotonic() + self.settle
+
+                now = monotonic()
+                ready: dict[str, list[str]] = {}
+                for key, ready_at in list(pending.items()):
+                    if ready_at is not None and ready_at <= now:
+                        path = os.path.join(*key)
+                        if os.path.isdir(path) and not os.path.islink(path) and time() - newest_write(path) < self.settle:
+                            # Still being filled, e.g. an archive being extracted
+                            pending[key] = now + self.settle
+                            continue
+                        del pending[key]
+                        ready.setdefault(key[0], []).append(key[1])
+
+                for target_path, names in ready.items():
+                    report = clean_entries(self.config, targets[target_path], names, progress, retry, content, destinations)
+                    if on_report:
+                        on_report(report)
+        finally:
+            backend.close()
+            if content:
+                content.close()
@@ -1,17 +1,54 @@
+from collections import deque
+from pathlib import Path
+from time import monotonic
+from typing import Callable, Iterable
 from config import Config, Filter, Target
+from cron import parse_schedule
+from plan import MovePlan
 from PyQt6.QtWidgets import (
-    QPushButton, QListWidget, QWidget,
-    QListWidgetItem, QDialog, QVBoxLayout,
+    QPushButton, QListView, QWidget,
+    QDialog, QVBoxLayout,
     QLineEdit, QHBoxLayout, QFileDialog,
-    QProgressBar, QLabel
+    QProgressBar, QLabel, QTableView,
+    QHeaderView, QAbstractItemView,
+    QCheckBox, QSpinBox, QMessageBox
 )
 from PyQt6.QtGui import QIcon
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import (
+    Qt, QAbstractListModel, QAbstractTableModel, QModelIndex,
+    QObject, QSortFilterProxyModel, QTimer, pyqtSignal
+)
 
 QLineEdit_dark_stylesheet = """ QLineEdit { color: white; } """
 QLineEdit_light_stylesheet = """ QLineEdit { color: black; } """
 
+class ConfigSaver(QObject):
+    # Edits come in bursts (reordering, deleting several entries), fc.conf is
+    # written once they settle instead of after each one
+    SAVE_DELAY_MS = 500
+
+    def __init__(self, config: Config, parent=None):
+        super().__init__(parent)
+        self.config = config
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.SAVE_DELAY_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def schedule(self):
+        # Restarts the delay, the last of several edits triggers the save
+        self._timer.start()
+
+    def flush(self):
+        self._timer.stop()
+        self.config.save()
+
 class CleaningProgressBar(QWidget):
+    # Repaints at most this often however fast the counts come in
+    UPDATE_INTERVAL_MS = 33
+    # Seconds of history the files/s and MB/s rates are measured over
+    RATE_WINDOW = 5.0
+
     def __init__(self, parent=None):
         super().__init__(parent)
         layout = QVBoxLayout(self)
@@ -22,29 +59,264 @@ class CleaningProgressBar(QWidget):
         self.progress_bar = QProgressBar(self)
         layout.addWidget(self.progress_bar)
 
+        self._text = ''
+        self._value = 0
+        self._size = 0
+        # (time, files, bytes) samples for the rates
+        self._samples: deque = deque()
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.UPDATE_INTERVAL_MS)
+        self._timer.timeout.connect(self._refresh)
+
+    # Batched API: counts can be reported as often as wanted, they are coalesced
+
+    def setProgress(self, value: int, size: int = 0):
+        # Files and bytes done since the last setValue(0)
+        if value < self._value:
+            self._samples.clear()
+        self._value = value
+        self._size = size
+        self._schedule()
+
+    def increment(self, value=1, size=0):
+        self.setProgress(self._value + value, self._size + size)
+
+    def decrement(self, value=1):
+        self.setProgress(max(0, self._value - value), self._size)
+
     def setValue(self, value):
-        self.progress_bar.setValue(value)
-    
+        self.setProgress(value, 0 if value == 0 else self._size)
+
     def setMaximum(self, value):
         self.progress_bar.setMaximum(value)
+        self._schedule()
 
-    def increment(self, value=1):
-        self.progress_bar.setValue(self.progress_bar.value() + value)
-    
-    def decrement(self, value=1):
-        self.progress_bar.setValue(self.progress_bar.value() - value)
-    
     def setLabelText(self, text):
+        self._text = text
+        self._schedule()
+
+    def _schedule(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _rates(self, now: float):
+        samples = self._samples
+        samples.append((now, self._value, self._size))
+        while len(samples) > 2 and now - samples[0][0] > self.RATE_WINDOW:
+            samples.popleft()
+        start, files, size = samples[0]
+        elapsed = now - start
+        if elapsed <= 0:
+            return None, None
+        return (self._value - files) / elapsed, (self._size - size) / elapsed
+
+    def _refresh(self):
+        maximum = self.progress_bar.maximum()
+        self.progress_bar.setValue(min(self._value, maximum) if maximum else self._value)
+
+        done = maximum > 0 and self._value >= maximum
+        if self._value == 0 or done:
+            # Nothing is running, only show what the caller wrote
+            self._samples.clear()
+            self.label.setText(self._text)
+            return
+
+        text = f'{self._text} {self._value}' + (f' / {maximum}' if maximum else '') + ' files'
+        files_per_second, bytes_per_second = self._rates(monotonic())
+        if files_per_second is not None:
+            text += f', {files_per_second:.0f} files/s, {bytes_per_second / 1024 / 1024:.1f} MB/s'
+            if maximum and files_per_second > 0:
+                eta = int((maximum - self._value) / files_per_second)
+                text += f', ETA {eta // 60}:{eta % 60:02d}'
         self.label.setText(text)
 
-class CustomFilterItem(QListWidgetItem):
-    def __init__(self, filter: Filter):
-        super().__init__(filter.name)
-        self.filter = filter
-        super().setFlags(Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled)
+def format_size(size: int):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+class PlanTableModel(QAbstractTableModel):
+    headers = ['Source', 'Destination', 'Filter', 'Reason', 'Size']
+
+    def __init__(self, plan: MovePlan, parent=None):
+        super().__init__(parent)
+        self.plan = plan
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.plan.moves)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        # Rows are only formatted when the view paints them
+        move = self.plan.moves[index.row()]
+        column = index.column()
+        if column == 0:
+            return move.source
+        if column == 1:
+            return move.destination or ''
+        if column == 2:
+            return move.filter or ''
+        if column == 3:
+            return move.reason
+        return format_size(move.size)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+class PlanDialog(QDialog):
+    def __init__(self, plan: MovePlan, parent=None):
+        super().__init__(parent)
+        self.resize(900, 500)
+        self.setWindowTitle("Cleaning Plan")
+        self.plan = plan
+
+        layout = QVBoxLayout(self)
+
+        summary = QLabel(f'{len(plan.to_move)} of {len(plan.moves)} files will be moved ({format_size(plan.total_size)}).', self)
+        layout.addWidget(summary)
+
+        self.table = QTableView(self)
+        self.model = PlanTableModel(plan, self)
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        # Fixed row heights keep the view from measuring every row of big plans
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        buttons_layout = QHBoxLayout()
+        execute_button = QPushButton("Execute", self)
+        execute_button.clicked.connect(self.accept)
+        buttons_layout.addWidget(execute_button)
+
+        save_button = QPushButton("Save Plan...", self)
+        save_button.clicked.connect(self.save_plan)
+        buttons_layout.addWidget(save_button)
+
+        close_button = QPushButton("Close", self)
+        close_button.clicked.connect(self.reject)
+        buttons_layout.addWidget(close_button)
+
+        layout.addLayout(buttons_layout)
+
+    def save_plan(self):
+        file, _ = QFileDialog.getSaveFileName(self, "Save Plan", "plan.json", "Plan (*.json)")
+        if file:
+            self.plan.save(Path(file))
+
+class ListModel(QAbstractListModel):
+    # Rows of a Python list edited in place. Views are told about each inserted, moved
+    # or removed row instead of being rebuilt, and rows are only formatted when painted.
+    def __init__(self, items: list, text: Callable[[object], str] = str, parent=None):
+        super().__init__(parent)
+        self.items = items
+        self.text = text
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.text(self.items[index.row()])
+        if role == Qt.ItemDataRole.UserRole:
+            return self.items[index.row()]
+        return None
+
+    def set_items(self, items: list):
+        # For a list replaced as a whole, e.g. a config loaded again
+        self.beginResetModel()
+        self.items = items
+        self.endResetModel()
+
+    def append(self, item):
+        self.insert(len(self.items), item)
+
+    def insert(self, row: int, item):
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.items.insert(row, item)
+        self.endInsertRows()
+
+    def replace(self, row: int, item):
+        self.items[row] = item
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def move(self, row: int, to: int):
+        if to == row or not 0 <= to < len(self.items):
+            return False
+        # Qt wants the row the item lands before, counted before it is taken out
+        self.beginMoveRows(QModelIndex(), row, row, QModelIndex(), to + 1 if to > row else to)
+        self.items.insert(to, self.items.pop(row))
+        self.endMoveRows()
+        return True
+
+    def remove(self, rows: Iterable[int]):
+        # Contiguous rows go in one step, last ones first so the others keep their row
+        rows = sorted(set(rows), reverse=True)
+        while rows:
+            last = first = rows.pop(0)
+            while rows and rows[0] == first - 1:
+                first = rows.pop(0)
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.items[first:last + 1]
+            self.endRemoveRows()
+
+class SearchableList(QWidget):
+    # A ListModel behind a search box. Rows given and returned are rows of the
+    # model, whatever the search hides.
+    rowActivated = pyqtSignal(int)
+
+    def __init__(self, model: ListModel, placeholder: str = "Search", parent=None):
+        super().__init__(parent)
+        self.model = model
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText(placeholder)
+        self.search_edit.setClearButtonEnabled(True)
+        layout.addWidget(self.search_edit)
+
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(model)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.search_edit.textChanged.connect(self.proxy.setFilterFixedString)
+
+        self.view = QListView(self)
+        self.view.setModel(self.proxy)
+        # Same height for every row, the view does not measure thousands of them
+        self.view.setUniformItemSizes(True)
+        self.view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.view.doubleClicked.connect(lambda index: self.rowActivated.emit(self.proxy.mapToSource(index).row()))
+        layout.addWidget(self.view)
+
+    def setSelectionMode(self, mode: QAbstractItemView.SelectionMode):
+        self.view.setSelectionMode(mode)
+
+    def current_row(self):
+        index = self.view.currentIndex()
+        return self.proxy.mapToSource(index).row() if index.isValid() else -1
+
+    def set_current_row(self, row: int):
+        self.view.setCurrentIndex(self.proxy.mapFromSource(self.model.index(row)))
+
+    def selected_rows(self) -> list[int]:
+        return [self.proxy.mapToSource(index).row() for index in self.view.selectionModel().selectedIndexes()]
 
-    def __repr__(self):
-        return self.filter.name
 class FilterEditorDialog(QDialog):
     def __init__(self, config:Config, filter=None, parent=None):
         super().__init__(parent)
@@ -58,7 +330,9 @@ class FilterEditorDialog(QDialog):
         self.name_edit.setPlaceholderText("Filter Name")
         layout.addWidget(self.name_edit)
 
-        self.expressions_list = QListWidget(self)
+        self.expressions_model = ListModel(list(filter.expressions) if filter else [], parent=self)
+        self.expressions_list = SearchableList(self.expressions_model, "Search Expressions", self)
+        self.expressions_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         layout.addWidget(self.expressions_list)
 
         self.expression_edit = QLineEdit(self)
@@ -87,8 +361,6 @@ class FilterEditorDialog(QDialog):
         if self.filter:
             self.name_edit.setText(self.filter.name)
             self.folder_edit.setText(self.filter.folder)
-            for expression in self.filter.expressions:
-                self.expressions_list.addItem(QListWidgetItem(expression))
 
         # Apply custom stylesheet for QLineEdit widgets
         self.set_stylesheet()
@@ -98,19 +370,20 @@ class FilterEditorDialog(QDialog):
 
         stylesheet = QLineEdit_dark_stylesheet if "dark" in self.config.theme else QLineEdit_light_stylesheet
         self.name_edit.setStyleSheet(stylesheet)
+        self.expressions_list.search_edit.setStyleSheet(stylesheet)
         self.expression_edit.setStyleSheet(stylesheet)
         self.folder_edit.setStyleSheet(stylesheet)
 
     def add_expression(self):
         expression = self.expression_edit.text().strip()
         if expression:
-            self.expressions_list.addItem(QListWidgetItem(expression))
+            self.expressions_model.append(expression)
             self.expression_edit.clear()
 
     def save(self):
         name = self.name_edit.text().strip()
         folder = self.folder_edit.text().strip()
-        expressions = [self.expressions_list.item(i).text() for i in range(self.expressions_list.count())]
+        expressions = list(self.expressions_model.items)
 
         if name and folder and expressions:
             self.filter = Filter(name, expressions, folder)
@@ -118,24 +391,11 @@ class FilterEditorDialog(QDialog):
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key.Key_Delete:
-            selected_items = self.expressions_list.selectedItems()
-            if not selected_items:
-                return
-            for item in selected_items:
-                self.expressions_list.takeItem(self.expressions_list.row(item))
+            self.expressions_model.remove(self.expressions_list.selected_rows())
         else:
             super().keyPressEvent(event)
 
 
-class CustomTargetItem(QListWidgetItem):
-    def __init__(self, target: Target):
-        super().__init__(target.name + " - " + target.path)
-        self.target = target
-        super().setFlags(Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled)
-
-    def __repr__(self):
-        return self.target.name
-    
 class TargetEditorDialog(QDialog):
     def __init__(self, config: Config, target=None, parent=None):
         super().__init__(parent)
@@ -162,6 +422,47 @@ class TargetEditorDialog(QDialog):
 
         layout.addLayout(path_layout)
 
+        recursive_layout = QHBoxLayout()
+        self.recursive_check = QCheckBox("Include subfolders", self)
+        recursive_layout.addWidget(self.recursive_check)
+
+        # 0 is a depth of its own (the top level only), no limit is the unchecked box
+        self.limit_depth_check = QCheckBox("Limit depth", self)
+        recursive_layout.addWidget(self.limit_depth_check)
+
+        self.max_depth_spin = QSpinBox(self)
+        self.max_depth_spin.setRange(0, 1000)
+        self.max_depth_spin.setPrefix("Max depth: ")
+        self.max_depth_spin.setEnabled(False)
+        self.limit_depth_check.toggled.connect(self.max_depth_spin.setEnabled)
+        recursive_layout.addWidget(self.max_depth_spin)
+        layout.addLayout(recursive_layout)
+
+        self.exclude_edit = QLineEdit(self)
+        self.exclude_edit.setPlaceholderText("Exclude (e.g. node_modules, *.part)")
+        layout.addWidget(self.exclude_edit)
+
+        self.schedule_edit = QLineEdit(self)
+        self.schedule_edit.setPlaceholderText("Schedule (e.g. 30m or 0 2 * * *)")
+        layout.addWidget(self.schedule_edit)
+
+        limits_layout = QHBoxLayout()
+        self.files_per_second_spin = QSpinBox(self)
+        self.files_per_second_spin.setRange(0, 100000)
+        self.files_per_second_spin.setSuffix(" files/s")
+        self.files_per_second_spin.setSpecialValueText("No file limit")
+        limits_layout.addWidget(self.files_per_second_spin)
+
+        self.mb_per_second_spin = QSpinBox(self)
+        self.mb_per_second_spin.setRange(0, 100000)
+        self.mb_per_second_spin.setSuffix(" MB/s")
+        self.mb_per_second_spin.setSpecialValueText("No size limit")
+        limits_layout.addWidget(self.mb_per_second_spin)
+
+        self.low_priority_check = QCheckBox("Low priority", self)
+        limits_layout.addWidget(self.low_priority_check)
+        layout.addLayout(limits_layout)
+
         buttons_layout = QHBoxLayout()
         save_button = QPushButton("Save", self)
         save_button.clicked.connect(self.save)
@@ -176,6 +477,14 @@ class TargetEditorDialog(QDialog):
         if self.target:
             self.name_edit.setText(self.target.name)
             self.path_edit.setText(self.target.path)
+            self.recursive_check.setChecked(self.target.recursive)
+            self.limit_depth_check.setChecked(self.target.max_depth is not None)
+            self.max_depth_spin.setValue(self.target.max_depth or 0)
+            self.exclude_edit.setText(", ".join(self.target.exclude))
+            self.schedule_edit.setText(self.target.schedule or "")
+            self.files_per_second_spin.setValue(int(self.target.max_files_per_second or 0))
+            self.mb_per_second_spin.setValue(int(self.target.max_mb_per_second or 0))
+            self.low_priority_check.setChecked(self.target.low_priority)
 
         # Apply custom stylesheet for QLineEdit widgets
         self.set_stylesheet()
@@ -184,6 +493,8 @@ class TargetEditorDialog(QDialog):
         stylesheet = QLineEdit_dark_stylesheet if "dark" in self.config.theme else QLineEdit_light_stylesheet
         self.name_edit.setStyleSheet(stylesheet)
         self.path_edit.setStyleSheet(stylesheet)
+        self.exclude_edit.setStyleSheet(stylesheet)
+        self.schedule_edit.setStyleSheet(stylesheet)
 
     def select_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Folder")
@@ -193,9 +504,28 @@ class TargetEditorDialog(QDialog):
     def save(self):
         name = self.name_edit.text().strip()
         path = self.path_edit.text().strip()
+        schedule = self.schedule_edit.text().strip() or None
+        if schedule:
+            try:
+                parse_schedule(schedule)
+            except ValueError as e:
+                QMessageBox.warning(self, "Invalid schedule", str(e))
+                return
 
         if name and path:
-            self.target = Target(name, path)
+            options = {
+                'name': name,
+                'path': path,
+                'recursive': self.recursive_check.isChecked(),
+                'max_depth': self.max_depth_spin.value() if self.limit_depth_check.isChecked() else None,
+                'exclude': [glob.strip() for glob in self.exclude_edit.text().split(',') if glob.strip()],
+                'schedule': schedule,
+                'max_files_per_second': self.files_per_second_spin.value() or None,
+                'max_mb_per_second': self.mb_per_second_spin.value() or None,
+                'low_priority': self.low_priority_check.isChecked()
+            }
+            # Keep the options the dialog does not edit
+            self.target = Target.from_json({**self.target.json(), **options} if self.target else options)
             self.accept()
 
     def keyPressEvent(self, event):
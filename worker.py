@@ -0,0 +1,111 @@
+from threading import Event
+from time import monotonic
+from PyQt6.QtCore import QObject, pyqtSignal
+from config import Config
+
+class CleaningWorker(QObject):
+    labelChanged = pyqtSignal(str)
+    maximumChanged = pyqtSignal(int)
+    # Files and bytes done, sent at most once per interval
+    progressChanged = pyqtSignal(int, 'qint64')
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, config: Config, interval: float = 1 / 30, task=None):
+        super().__init__()
+        self.config = config
+        # Called as task(config, progress, cancel=event) on the worker thread, helper.clean_folders by default
+        self.task = task
+        self._stop = Event()
+        # Minimum delay between two value updates sent to the GUI thread
+        self.interval = interval
+        self._value = 0
+        self._size = 0
+        self._sent = None
+        self._last_emit = 0.0
+
+    def run(self):
+        from helper import clean_folders
+        task = self.task or clean_folders
+        try:
+            result = task(self.config, self, cancel=self._stop)
+        except Exception as e:
+            self._flush()
+            self.failed.emit(str(e))
+            return
+        self._flush()
+        self.finished.emit(result)
+
+    def stop(self):
+        # Called from the GUI thread, the task checks the event between files
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    # Progress interface used by helper.clean_folders, called from the worker thread
+
+    def setLabelText(self, text):
+        self._flush()
+        self.labelChanged.emit(text)
+
+    def setMaximum(self, value):
+        self._flush()
+        self.maximumChanged.emit(value)
+
+    def setValue(self, value):
+        self._value = value
+        if value == 0:
+            self._size = 0
+        self._flush()
+
+    def increment(self, value=1, size=0):
+        self._value += value
+        self._size += size
+        now = monotonic()
+        if now - self._last_emit >= self.interval:
+            self._flush(now)
+
+    def _flush(self, now=None):
+        if (self._value, self._size) != self._sent:
+            self._sent = (self._value, self._size)
+            self.progressChanged.emit(self._value, self._size)
+        self._last_emit = now if now is not None else monotonic()
+
+class WatchWorker(CleaningWorker):
+    def __init__(self, config: Config, interval: float = 1 / 30):
+        super().__init__(config, interval)
+        self.moved = 0
+
+    def run(self):
+        from watcher import FolderWatcher
+        self.setLabelText(f'Watching {len(self.config.targets)} targets...')
+        try:
+            FolderWatcher(self.config).run(self, self._stop, self._on_report)
+        except Exception as e:
+            self._flush()
+            self.failed.emit(str(e))
+            return
+        self._flush()
+        self.finished.emit(self.moved)
+
+    def _on_report(self, report):
+        self.moved += report.moved
+        self.setLabelText(f'Watching {len(self.config.targets)} targets, moved {self.moved} files.')
+
+class ScheduleWorker(WatchWorker):
+    def run(self):
+        from scheduler import TargetScheduler
+        try:
+            TargetScheduler(self.config).run(self, self._stop, self._on_report)
+        except Exception as e:
+            self._flush()
+            self.failed.emit(str(e))
+            return
+        self._flush()
+        self.finished.emit(self.moved)
+
+    def _on_report(self, report):
+        self.moved += report.moved
+        self.setLabelText(f'{report.summary()} Moved {self.moved} files since the schedule started.')